@@ -65,8 +65,7 @@ def breakVigenere(c, r):
     return key
   
 def main():
-    with open('shakespeare.txt', 'r') as r:
-        reference_text = freq(r.read().lower())
+    reference_text = reference_model('shakespeare.txt').letter_frequencies()
 
     with open('caesar.txt', 'r') as c:
         ciphertext = c.read().lower()
@@ -77,8 +77,7 @@ def vigenere_key_length(c):
     return most_frequent[0]
     
 def main():
-    with open('shakespeare.txt', 'r') as f:
-        reference_text = freq(f.read().lower())
+    reference_text = reference_model('shakespeare.txt').letter_frequencies()
 
     with open('vigenere.txt', 'r') as f:
         cipher_text = "".join(line for line in f)
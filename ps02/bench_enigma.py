@@ -0,0 +1,182 @@
+"""
+bench_enigma.py
+Authors: Robbie Young, Antonio Marino
+Benchmarks for the hot paths: enigma() encipherment at several message
+sizes, compute_signature calls, and a catalog build over a subset of
+the rotor orders, with peak memory.  Results are printed as JSON, and
+can be checked against an earlier run to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from enigma import enigma, compute_signature, compute_sigs_for_settings, gen_rotor_perms, gen_starting_positions
+from catalog import write_catalog
+from substitution_ciphers import ALPHABET
+
+"""
+Takes in a function of no arguments and a number of repeats, and
+returns the best wall clock time of that many calls, in seconds
+"""
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+"""
+Takes in a random number generator, and returns a random configuration
+with the given number of plugboard pairs
+"""
+def random_config(rng, pairs=5):
+    letters = rng.sample(ALPHABET, 2 * pairs)
+    return (rng.sample(["I", "II", "III", "IV", "V"], 3)
+            + [[(letters[i], letters[i + 1]) for i in range(0, 2 * pairs, 2)],
+               "".join(rng.choice(ALPHABET) for i in range(3)), "".join(rng.choice(ALPHABET) for i in range(3))])
+
+"""
+Takes in a list of message sizes, a number of repeats and a random
+number generator, and returns the characters per second enigma()
+enciphers at each size, with the compiled engine and, for sizes up to
+traced_limit, the traced reference engine
+"""
+def bench_encipher(sizes, repeat, rng, traced_limit):
+    results = []
+    for size in sizes:
+        message = "".join(rng.choice(ALPHABET) for i in range(size))
+        config = random_config(rng)
+        for compiled in (True, False):
+            if not compiled and size > traced_limit:
+                continue
+            seconds = best_time(lambda: enigma(*config, compiled=compiled)(message), repeat)
+            results.append({"engine": "compiled" if compiled else "traced", "size": size,
+                            "seconds": seconds, "chars_per_second": size / seconds})
+    return results
+
+"""
+Takes in a number of calls, a number of repeats and a random number
+generator, and returns how many compute_signature calls run per second,
+once with an empty plugboard (as in the catalog, where the compiled
+tables are shared) and once with five pairs (where every call rebuilds
+its plugged tables)
+"""
+def bench_signature(calls, repeat, rng):
+    results = []
+    for pairs in (0, 5):
+        configs = [random_config(rng, pairs) for i in range(calls)]
+        seconds = best_time(lambda: [compute_signature(*config) for config in configs], repeat)
+        results.append({"plugboard_pairs": pairs, "calls": calls, "seconds": seconds,
+                        "calls_per_second": calls / seconds})
+    return results
+
+"""
+Takes in rotor permutations, settings and a file name, and builds the
+catalog for them and writes it to the file, returning the seconds spent
+building and the seconds in all
+"""
+def build_catalog(rotor_permutations, settings, filename):
+    start = time.perf_counter()
+    sig_to_config_dict = {}
+    for rotor_perm in rotor_permutations:
+        for signature, configs in compute_sigs_for_settings(rotor_perm, settings).items():
+            sig_to_config_dict.setdefault(signature, []).extend(configs)
+    build_seconds = time.perf_counter() - start
+    write_catalog(sig_to_config_dict, filename)
+    return build_seconds, time.perf_counter() - start
+
+"""
+Takes in a number of rotor orders and of starting positions per order,
+and builds and writes the catalog for the first that many of each,
+returning the time taken, the configurations per second and the peak
+memory allocated by Python while building and writing it.  tracemalloc
+slows the build down many times over, so the times come from one build
+and the peak memory from a second one.
+"""
+def bench_catalog(orders, positions):
+    rotor_permutations = gen_rotor_perms()[:orders]
+    settings = [("AAA", position) for position in gen_starting_positions()[:positions]]
+    handle, filename = tempfile.mkstemp(suffix=".bin")
+    os.close(handle)
+    build_seconds, seconds = build_catalog(rotor_permutations, settings, filename)
+    tracemalloc.start()
+    build_catalog(rotor_permutations, settings, filename)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = os.path.getsize(filename)
+    os.remove(filename)
+    configs = len(rotor_permutations) * len(settings)
+    return {"orders": len(rotor_permutations), "positions": len(settings), "configs": configs,
+            "build_seconds": build_seconds, "seconds": seconds, "configs_per_second": configs / seconds,
+            "peak_memory_bytes": peak, "file_bytes": size}
+
+"""
+Takes in the results of this run and of a baseline run, and a
+tolerance, and returns a list of the rates that fell by more than that
+fraction of the baseline's
+"""
+def regressions(results, baseline, tolerance):
+    found = []
+    def check(name, now, then):
+        if now < then * (1 - tolerance):
+            found.append("%s: %.0f/s, baseline %.0f/s (%.0f%% slower)" % (name, now, then, 100 * (1 - now / then)))
+    then_encipher = {(row["engine"], row["size"]): row["chars_per_second"] for row in baseline.get("encipher", [])}
+    for row in results["encipher"]:
+        if (row["engine"], row["size"]) in then_encipher:
+            check("%s enigma() at %d chars" % (row["engine"], row["size"]), row["chars_per_second"],
+                  then_encipher[(row["engine"], row["size"])])
+    then_signatures = {row["plugboard_pairs"]: row["calls_per_second"] for row in baseline.get("signatures", [])}
+    for row in results["signatures"]:
+        if row["plugboard_pairs"] in then_signatures:
+            check("compute_signature with %d plugboard pairs" % row["plugboard_pairs"], row["calls_per_second"],
+                  then_signatures[row["plugboard_pairs"]])
+    if results.get("catalog") and baseline.get("catalog"):
+        check("catalog", results["catalog"]["configs_per_second"], baseline["catalog"]["configs_per_second"])
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Enigma hot paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="message sizes to encipher")
+    parser.add_argument("--traced-limit", type=int, default=10000,
+                        help="largest message size to run the traced reference engine on")
+    parser.add_argument("--signatures", type=int, default=2000, help="compute_signature calls to time")
+    parser.add_argument("--orders", type=int, default=1, help="rotor orders in the catalog build (0 to skip)")
+    parser.add_argument("--positions", type=int, default=26 ** 3, help="starting positions per rotor order")
+    parser.add_argument("--repeat", type=int, default=3, help="take the best of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fraction a rate may fall below the baseline before it counts as a regression")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {
+        "python": sys.version.split()[0],
+        "encipher": bench_encipher(args.sizes, args.repeat, rng, args.traced_limit),
+        "signatures": bench_signature(args.signatures, args.repeat, rng),
+        "catalog": bench_catalog(args.orders, args.positions) if args.orders else None,
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print("regression: " + line, file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
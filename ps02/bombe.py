@@ -0,0 +1,168 @@
+"""
+bombe.py
+Authors: Robbie Young, Antonio Marino
+A Turing-Welchman style crib attack: given a ciphertext and a stretch
+of known plaintext, find the rotor orders and start positions (ring
+setting AAA) at which some plugboard is consistent with the crib
+"""
+
+import argparse
+import sys
+import time
+from enigma import gen_rotor_perms, scrambler_table, stepping_table, position_name, order_reflector
+from enigma import pool_imap, MACHINES, POSITIONS
+from substitution_ciphers import ltr2int, int2ltr
+
+# The plugboard S is an involution, and the machine enciphers p as
+# c = S(E_k(S(p))) on keystroke k, where E_k is the unsteckered scrambler.
+# Since E_k is an involution too, each crib letter pair gives the two-way
+# implication S(c) = E_k(S(p)) <=> S(p) = E_k(S(c)), and the "diagonal
+# board" gives S(x) = v <=> S(v) = x.  Hypotheses "S(x) = v" are nodes
+# x * 26 + v of an undirected graph with those implications as edges, so
+# a whole connected component is true or false together: it is false as
+# soon as it gives some letter two different partners.
+
+"""
+Takes in a ciphertext, a crib and the offset of the crib in the
+ciphertext, and returns the menu: for each letter, the list of
+(other letter, keystroke) pairs linking it to another letter
+"""
+def build_menu(ciphertext, crib, offset=0):
+    if not crib or offset + len(crib) > len(ciphertext):
+        raise ValueError("crib must be nonempty and lie within the ciphertext")
+    menu = {}
+    for i in range(len(crib)):
+        p, c, keystroke = ltr2int(crib[i]), ltr2int(ciphertext[offset + i]), offset + i + 1
+        if p == c:
+            raise ValueError("crib letter %s at keystroke %d enciphers to itself" % (crib[i], keystroke))
+        menu.setdefault(p, []).append((c, keystroke))
+        menu.setdefault(c, []).append((p, keystroke))
+    return menu
+
+"""
+Takes in a menu, and returns the letter with the most links, which is
+the letter whose partner the bombe tests
+"""
+def test_letter(menu):
+    return max(sorted(menu), key=lambda letter: len(menu[letter]))
+
+"""
+Takes in the menu links, the scrambler table for a rotor order, the
+table offsets of the rotors on each keystroke the menu uses, a starting
+hypothesis node and the labels of nodes already searched at this
+position, and explores everything the hypothesis implies, labelling
+those nodes with search_id.  Returns the nodes it reached and whether
+they are consistent.  Running into a node from an earlier search counts
+as a contradiction: a consistent earlier search took in its whole
+component, so the earlier search must have stopped on one.
+"""
+def explore(links, scrambler, offsets, start, labels, search_id):
+    partner = [-1] * 26
+    reached, stack = [], [start]
+    labels[start] = search_id
+    while stack:
+        node = stack.pop()
+        reached.append(node)
+        x, v = divmod(node, 26)
+        if partner[x] not in (-1, v):
+            return reached, False
+        partner[x] = v
+        for w in [y * 26 + scrambler[offsets[k] + v] for y, k in links[x]] + [v * 26 + x]:
+            if not labels[w]:
+                labels[w] = search_id
+                stack.append(w)
+            elif labels[w] != search_id:
+                return reached, False
+    return reached, True
+
+"""
+Takes in a menu, and returns it as a list of link lists indexed by
+letter, with each keystroke replaced by its index into the list of
+distinct keystrokes, along with that list
+"""
+def index_menu(menu):
+    keystrokes = sorted(set(k for letter in menu for _, k in menu[letter]))
+    position_of = {k: i for i, k in enumerate(keystrokes)}
+    links = [[(y, position_of[k]) for y, k in menu.get(x, [])] for x in range(26)]
+    return links, keystrokes
+
+"""
+Takes in a rotor order (optionally with a reflector spec after the
+rotors), a ciphertext, a crib and its offset, and returns the stops:
+every start position where some partner of the test letter survives,
+as configurations [slow, medi, fast, plugboard_pairs, "AAA", position]
+(and the order's reflector spec, if it has one) with the plugboard
+pairs the surviving hypothesis implies
+"""
+def bombe_run(rotor_perm, ciphertext, crib, offset=0):
+    slow, medi, fast = rotor_perm[:3]
+    menu = build_menu(ciphertext, crib, offset)
+    links, keystrokes = index_menu(menu)
+    tested = test_letter(menu)
+    scrambler = scrambler_table(slow, medi, fast, "AAA", order_reflector(rotor_perm))
+    next_position = stepping_table(medi, fast)
+
+    # offsets[i][p]: table offset of the rotors on keystroke keystrokes[i] from start p
+    offsets, positions = [], list(range(POSITIONS))
+    for k in range(1, keystrokes[-1] + 1):
+        positions = [next_position[p] for p in positions]
+        if k in keystrokes:
+            offsets.append([p * 26 for p in positions])
+
+    stops = []
+    for start in range(POSITIONS):
+        position_offsets = [column[start] for column in offsets]
+        labels = bytearray(676)
+        for guess in range(26):
+            node = tested * 26 + guess
+            if labels[node]:
+                continue
+            reached, consistent = explore(links, scrambler, position_offsets, node, labels, guess + 1)
+            if consistent:
+                pairs = sorted(set((int2ltr(min(x, v)), int2ltr(max(x, v)))
+                                   for x, v in map(lambda n: divmod(n, 26), reached) if x != v))
+                stops.append([slow, medi, fast, pairs, "AAA", position_name(start)] + rotor_perm[3:])
+    return stops
+
+"""
+unpacks the arguments for bombe_run, for use with pool_imap
+"""
+def bombe_shard(args):
+    return bombe_run(*args)
+
+"""
+Takes in a ciphertext, a crib and its offset, and runs the bombe over
+every rotor order (or the given ones) of the problem set's machine or
+of a model from MACHINES, in a pool of processes if asked for more than
+one.  Returns all the stops, reporting progress on stderr.
+"""
+def bombe(ciphertext, crib, offset=0, rotor_permutations=None, processes=1, model=None):
+    if rotor_permutations is None:
+        rotor_permutations = gen_rotor_perms(model)
+    jobs = [(rotor_perm, ciphertext, crib, offset) for rotor_perm in rotor_permutations]
+    stops, start_time = [], time.time()
+    for done, order_stops in enumerate(pool_imap(bombe_shard, jobs, processes), 1):
+        stops.extend(order_stops)
+        print("order %d/%d (%s) done after %.1fs, %d stops" % (done, len(jobs),
+              "/".join(jobs[done - 1][0]), time.time() - start_time, len(order_stops)), file=sys.stderr)
+    return stops
+
+def main():
+    parser = argparse.ArgumentParser(description="Crib attack on Enigma ciphertext (ring setting AAA).")
+    parser.add_argument("ciphertext")
+    parser.add_argument("crib")
+    parser.add_argument("--offset", type=int, default=0, help="where the crib starts in the ciphertext")
+    parser.add_argument("--rotors", nargs=3, help="only try this rotor order")
+    parser.add_argument("--reflector", help="reflector spec for --rotors, e.g. C or B-thin,beta,AQ")
+    parser.add_argument("--model", choices=sorted(MACHINES), help="try every rotor order and reflector of this model")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes (0 for one per core)")
+    args = parser.parse_args()
+    rotor_permutations = None
+    if args.rotors:
+        rotor_permutations = [args.rotors + ([args.reflector] if args.reflector else [])]
+    for stop in bombe(args.ciphertext.upper(), args.crib.upper(), args.offset,
+                      rotor_permutations, args.processes or None, args.model):
+        print(stop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+catalog.py
+Authors: Robbie Young, Antonio Marino
+Compact binary storage for the signature to configuration catalog
+"""
+
+import argparse
+import mmap
+import struct
+from ast import literal_eval
+from bisect import bisect_left
+from substitution_ciphers import ltr2int, int2ltr
+
+# A catalog file is laid out as
+#
+#   header     magic, version, #rotor orders, #signatures, #records,
+#              #ring settings, bytes per record
+#   orders     u32 length, then the rotor orders as ASCII, one per line
+#              with the three rotor names separated by spaces, and then
+#              the reflector spec if it is not the default "B"
+#   rings      u32 length, then the ring settings as ASCII, one per line
+#   index      one entry per signature, sorted by signature: the cycle
+#              lengths zero-padded to 26 bytes, the number of the first
+#              record for that signature, and how many records it has
+#   records    one per configuration, (order id * #ring settings + ring
+#              id) * 26^3 + position index, grouped by signature in index
+#              order; u32, or u64 if the numbers would not fit
+#
+# Everything is little-endian.  Only configurations with an empty
+# plugboard are representable.  Version 1 files, from before ring
+# settings, have no ring fields and are read as ring setting "AAA".
+
+MAGIC = b"SIGCAT"
+VERSION = 2
+HEADER_V1 = struct.Struct("<6sHIII")
+HEADER = struct.Struct("<6sHIIIIB")
+LENGTH = struct.Struct("<I")
+ENTRY = struct.Struct("<26sII")
+RECORD_FORMATS = {4: "I", 8: "Q"}
+POSITIONS = 26 ** 3
+
+"""
+Takes in a signature (a tuple of cycle lengths), and returns
+its fixed-width 26 byte key
+"""
+def signature_key(signature):
+    return bytes(signature).ljust(26, b"\0")
+
+"""
+Takes in a 26 byte key, and returns the signature it stands for
+"""
+def key_signature(key):
+    return tuple(key.rstrip(b"\0"))
+
+"""
+Takes in a three letter position, and returns its index in
+AAA, AAB, ..., ZZZ
+"""
+def position_index(position):
+    return (ltr2int(position[0]) * 26 + ltr2int(position[1])) * 26 + ltr2int(position[2])
+
+"""
+Takes in an index in AAA, AAB, ..., ZZZ, and returns the position
+"""
+def index_position(index):
+    return int2ltr(index // 676) + int2ltr(index // 26) + int2ltr(index)
+
+"""
+Takes in the number of rotor orders and ring settings in a catalog,
+and returns how many bytes each of its records needs
+"""
+def record_size(n_orders, n_rings):
+    return 4 if n_orders * n_rings * POSITIONS <= 2 ** 32 else 8
+
+"""
+Takes in an open file, the rotor orders and ring settings, the index
+entries and the number of records, and writes everything before the
+records, returning the bytes per record
+"""
+def write_header(f, orders, rings, index, n_records):
+    order_text = "\n".join(" ".join(order) for order in orders).encode("ascii")
+    ring_text = "\n".join(rings).encode("ascii")
+    size = record_size(len(orders), len(rings))
+    f.write(HEADER.pack(MAGIC, VERSION, len(orders), len(index), n_records, len(rings), size))
+    f.write(LENGTH.pack(len(order_text)) + order_text)
+    f.write(LENGTH.pack(len(ring_text)) + ring_text)
+    for entry in index:
+        f.write(ENTRY.pack(*entry))
+    return size
+
+"""
+Takes in a dictionary of signatures to configurations and a filename,
+and writes the dictionary to the file in the binary catalog format
+"""
+def write_catalog(sig_to_config_dict, filename):
+    orders, order_ids, rings, ring_ids, index, configs = [], {}, [], {}, [], []
+    for signature in sorted(sig_to_config_dict, key=signature_key):
+        index.append((signature_key(signature), len(configs), len(sig_to_config_dict[signature])))
+        for config in sig_to_config_dict[signature]:
+            slow, medi, fast, plugboard_pairs, ring_setting, position = config[:6]
+            if plugboard_pairs:
+                raise ValueError("catalog only stores configurations with no plugboard")
+            order = (slow, medi, fast) + tuple(reflector for reflector in config[6:] if reflector != "B")
+            if order not in order_ids:
+                order_ids[order] = len(orders)
+                orders.append(order)
+            if ring_setting not in ring_ids:
+                ring_ids[ring_setting] = len(rings)
+                rings.append(ring_setting)
+            configs.append((order_ids[order], ring_ids[ring_setting], position_index(position)))
+    records = [(order_id * len(rings) + ring_id) * POSITIONS + position for order_id, ring_id, position in configs]
+    with open(filename, "wb") as f:
+        size = write_header(f, orders, rings, index, len(records))
+        f.write(struct.pack("<%d%s" % (len(records), RECORD_FORMATS[size]), *records))
+
+"""
+Takes in a list of binary catalog files and a filename, and writes the
+catalog holding all of their configurations, each signature listing
+the files' configurations in the order the files are given.  The files
+are read one at a time and only one signature's records of one file
+are in memory at once, so catalogs far bigger than memory can be merged.
+"""
+def merge_catalogs(filenames, filename):
+    orders, order_ids, rings, ring_ids, counts = [], {}, [], {}, {}
+    for name in filenames:
+        with SignatureCatalog(name) as catalog:
+            for order in catalog.orders:
+                if tuple(order) not in order_ids:
+                    order_ids[tuple(order)] = len(orders)
+                    orders.append(tuple(order))
+            for ring_setting in catalog.rings:
+                if ring_setting not in ring_ids:
+                    ring_ids[ring_setting] = len(rings)
+                    rings.append(ring_setting)
+            for i in range(len(catalog)):
+                key, _, count = catalog[i]
+                counts[key] = counts.get(key, 0) + count
+    index, next_record, first = [], {}, 0
+    for key in sorted(counts):
+        index.append((key, first, counts[key]))
+        next_record[key], first = first, first + counts[key]
+    with open(filename, "wb") as f:
+        size = write_header(f, orders, rings, index, sum(counts.values()))
+        records_start = f.tell()
+        for name in filenames:
+            with SignatureCatalog(name) as catalog:
+                # what each of this file's order and ring pairs is numbered in the merged catalog
+                bases = [(order_ids[tuple(order)] * len(rings) + ring_ids[ring_setting]) * POSITIONS
+                         for order in catalog.orders for ring_setting in catalog.rings]
+                for i in range(len(catalog)):
+                    key, _, count = catalog[i]
+                    records = [bases[config_id // POSITIONS] + config_id % POSITIONS
+                               for config_id in catalog.entry_config_ids(i)]
+                    f.seek(records_start + next_record[key] * size)
+                    f.write(struct.pack("<%d%s" % (count, RECORD_FORMATS[size]), *records))
+                    next_record[key] += count
+
+"""
+Takes in the name of a text catalog written by
+write_to_sig_to_config_file, and yields its signature,
+configuration list pairs one line at a time
+"""
+def read_text_catalog(filename):
+    with open(filename, "r") as f:
+        for line in f:
+            signature, configs = line.split(":", 1)
+            yield literal_eval(signature), literal_eval(configs)
+
+class SignatureCatalog:
+    '''A read-only view of a binary catalog file.  The file is memory
+       mapped, so opening it reads only the header and rotor orders;
+       lookups binary search the index in place.'''
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER_V1.unpack_from(self.data, 0)[:2]
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError("%s is not a version 1 or %d signature catalog" % (filename, VERSION))
+        if version == 1:
+            _, _, n_orders, self.n_signatures, self.n_records = HEADER_V1.unpack_from(self.data, 0)
+            start, self.rings, size = HEADER_V1.size, ["AAA"], 4
+        else:
+            _, _, n_orders, self.n_signatures, self.n_records, n_rings, size = HEADER.unpack_from(self.data, 0)
+            start = HEADER.size
+        self.orders, start = self.read_lines(start)
+        self.orders = [order.split(" ") for order in self.orders]
+        if version != 1:
+            self.rings, start = self.read_lines(start)
+        self.record_format = RECORD_FORMATS[size]
+        self.record_size = size
+        self.index_start = start
+        self.records_start = self.index_start + self.n_signatures * ENTRY.size
+
+    def read_lines(self, start):
+        '''Reads the length-prefixed block of text lines at start, and
+           returns the lines and where the block ends.'''
+        (length,) = LENGTH.unpack_from(self.data, start)
+        start += LENGTH.size
+        return self.data[start:start + length].decode("ascii").split("\n"), start + length
+
+    def __len__(self):
+        '''Returns the number of distinct signatures.'''
+        return self.n_signatures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def __getitem__(self, i):
+        '''Returns the (key, first record, record count) of index entry i.'''
+        return ENTRY.unpack_from(self.data, self.index_start + i * ENTRY.size)
+
+    def find(self, signature):
+        '''Returns the index entry number for signature, or None.'''
+        key = signature_key(signature)
+        keys = KeyView(self)
+        i = bisect_left(keys, key)
+        if i < len(self) and keys[i] == key:
+            return i
+        return None
+
+    def count(self, signature):
+        '''Returns how many configurations have the given signature.'''
+        i = self.find(signature)
+        return 0 if i is None else self[i][2]
+
+    def config_ids(self, signature):
+        '''Returns the packed records ((order id * #ring settings + ring
+           id) * 26^3 + position index) of every configuration with the
+           given signature.'''
+        i = self.find(signature)
+        if i is None:
+            return ()
+        return self.entry_config_ids(i)
+
+    def entry_config_ids(self, i):
+        '''Returns the packed records listed under index entry i.'''
+        _, first, count = self[i]
+        return struct.unpack_from("<%d%s" % (count, self.record_format), self.data,
+                                  self.records_start + first * self.record_size)
+
+    def config(self, config_id):
+        '''Unpacks a record into [slow, medi, fast, [], ring_setting, position],
+           followed by the reflector spec if it is not "B".'''
+        order_id, ring_id = divmod(config_id // POSITIONS, len(self.rings))
+        order = self.orders[order_id]
+        return order[:3] + [[], self.rings[ring_id], index_position(config_id % POSITIONS)] + order[3:]
+
+    def lookup(self, signature):
+        '''Returns every configuration with the given signature.'''
+        return [self.config(config_id) for config_id in self.config_ids(signature)]
+
+    def signatures(self):
+        '''Yields (signature, count) for every signature in the catalog.'''
+        for i in range(len(self)):
+            key, _, count = self[i]
+            yield key_signature(key), count
+
+class KeyView:
+    '''The sorted signature keys of a catalog, as a sequence bisect can search.'''
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, i):
+        return self.catalog[i][0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a text signature catalog to the binary format.")
+    parser.add_argument("text_file", nargs="?", default="sig_to_config.txt")
+    parser.add_argument("binary_file", nargs="?", default="sig_to_config.bin")
+    args = parser.parse_args()
+    write_catalog(dict(read_text_catalog(args.text_file)), args.binary_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+diff_enigma.py
+Authors: Robbie Young, Antonio Marino
+A differential test of the fast Enigma engines against the reference
+one (the traced Rotor machine, enigma(..., compiled=False)): random
+machines, rotor orders, ring settings, start positions (often just
+before a turnover, to exercise double stepping), plugboards and
+messages are run through both, and any case where they disagree is
+shrunk to a minimal failing configuration and reported
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from enigma import enigma, period_table, table_enigma, enigma_batch, enigma_messages
+from enigma import keystroke_permutations, compute_signature, gen_reflectors
+from enigma import pool_imap, MACHINES, ROTOR_TURNOVERS
+from substitution_ciphers import ALPHABET, ltr2int, int2ltr
+
+# keystrokes compared by the keystroke permutation check: the six of a
+# doubled message key, which is what the signatures are made from
+KEYSTROKES = (1, 2, 3, 4, 5, 6)
+
+"""
+Takes in a random number generator and a rotor name, and returns a
+window letter for it: half the time any letter, half the time one to
+three letters before one of its turnovers, so that it steps its
+neighbour (or, for the middle rotor, double steps) within a message
+"""
+def random_window(rng, rotor):
+    if ROTOR_TURNOVERS[rotor] and rng.random() < 0.5:
+        return int2ltr(ltr2int(rng.choice(ROTOR_TURNOVERS[rotor])) - 1 - rng.randrange(3))
+    return rng.choice(ALPHABET)
+
+"""
+Takes in a random number generator, and returns a random case: a
+configuration [slow, medi, fast, plugboard_pairs, ring_setting,
+initial_position, reflector] of a random model from MACHINES, and a
+message of up to max_length letters
+"""
+def random_case(rng, max_length=300, models=None):
+    model = rng.choice(sorted(models or MACHINES))
+    slow, medi, fast = rng.sample(MACHINES[model]["rotors"], 3)
+    reflector = rng.choice(gen_reflectors(model))
+    if "," in reflector:
+        reflector = reflector[:-2] + rng.choice(ALPHABET) + reflector[-1]
+    letters = rng.sample(ALPHABET, 26)
+    plugboard_pairs = [(letters[i], letters[i + 1]) for i in range(0, 2 * rng.randrange(14), 2)]
+    ring_setting = "".join(rng.choice(ALPHABET) for i in range(3))
+    position = "".join(random_window(rng, rotor) for rotor in (slow, medi, fast))
+    message = "".join(rng.choice(ALPHABET) for i in range(rng.randrange(max_length + 1)))
+    return [slow, medi, fast, plugboard_pairs, ring_setting, position, reflector], message
+
+"""
+Takes in a configuration and a message, and returns the reference
+results: the traced engine's output and windows, and the permutation
+it applies on each of KEYSTROKES.  The stepping never depends on the
+letters typed, so enciphering c six times shows where each of the six
+keystrokes sends c.
+"""
+def reference_results(config, message):
+    output, windows, _ = enigma(*config, compiled=False)(message, debug=True)
+    columns = [enigma(*config, compiled=False)(ALPHABET[c] * len(KEYSTROKES)) for c in range(26)]
+    perms = [[ltr2int(columns[c][k - 1]) for c in range(26)] for k in KEYSTROKES]
+    return output, windows, perms
+
+"""
+Takes in two permutations of the letter indices, and returns the cycle
+lengths, longest first, of the permutation taking each letter where the
+first sends it and then where the second sends that: the reference
+signature.  Kept apart from enigma.cycle_lengths, which is under test.
+"""
+def reference_signature(first, second):
+    letters, lengths = set(range(26)), []
+    while letters:
+        start = min(letters)
+        cycle = [start]
+        while second[first[cycle[-1]]] != start:
+            cycle.append(second[first[cycle[-1]]])
+        letters -= set(cycle)
+        lengths.append(len(cycle))
+    return tuple(sorted(lengths, reverse=True))
+
+"""
+Takes in a configuration, a message and whether to check the period
+table too (it takes a tenth of a second or so to build), and returns
+the names of the fast engines that disagree with the reference, each
+with what it gave.  An engine that raises counts as disagreeing.
+"""
+def check_case(config, message, tables=False):
+    slow, medi, fast, plugboard_pairs, ring_setting, position, reflector = config
+    output, windows, perms = reference_results(config, message)
+    checks = [
+        ("compiled", lambda: enigma(*config)(message), output),
+        ("compiled windows", lambda: enigma(*config)(message, debug=True)[1], windows),
+        ("batch", lambda: enigma_batch([config], message)[0], output),
+        ("messages", lambda: enigma_messages(config, [message, message[:len(message) // 2]]),
+         [output, output[:len(message) // 2]]),
+        ("keystrokes", lambda: keystroke_permutations(*config[:6], KEYSTROKES, reflector), perms),
+        ("signature", lambda: compute_signature(*config), reference_signature(perms[0], perms[3])),
+    ]
+    if tables:
+        checks.append(("period table", lambda: table_enigma(*period_table(*config))(message), output))
+    failures = []
+    for name, run, expected in checks:
+        try:
+            got = run()
+        except Exception as error:
+            got = "%s: %s" % (type(error).__name__, error)
+        if got != expected:
+            failures.append((name, got))
+    return failures
+
+"""
+Takes in a configuration and a message that some engine gets wrong,
+and a predicate saying whether a case still fails, and shrinks the
+case greedily: shorter messages, fewer plugboard pairs, ring setting
+and window letters moved towards A, and the plainest reflector, keeping
+each change that still fails.  Returns the smallest failing case found.
+"""
+def shrink(config, message, fails):
+    config = list(config)
+    changed = True
+    while changed:
+        changed = False
+        candidates = []
+        for cut in (len(message) // 2, len(message) - 1):
+            if 0 <= cut < len(message):
+                candidates += [(config, message[:cut]), (config, message[len(message) - cut:])]
+        for i in range(len(config[3])):
+            candidates.append((config[:3] + [config[3][:i] + config[3][i + 1:]] + config[4:], message))
+        for field in (4, 5):
+            for i in range(3):
+                if config[field][i] != "A":
+                    for letter in ("A", int2ltr(ltr2int(config[field][i]) - 1)):
+                        setting = config[field][:i] + letter + config[field][i + 1:]
+                        candidates.append((config[:field] + [setting] + config[field + 1:], message))
+        if "," in config[6]:
+            candidates.append((config[:6] + [config[6][:-2] + "AA"], message))
+        for candidate in candidates:
+            if candidate != (config, message) and fails(*candidate):
+                config, message = candidate
+                changed = True
+                break
+    return config, message
+
+"""
+Takes in a run seed and a case number, and checks that case, shrinking
+it if it fails.  Returns None, or the minimal failing case with the
+engines that got it wrong.
+"""
+def run_case(args):
+    seed, number, max_length, models, tables = args
+    config, message = random_case(random.Random("%s-%d" % (seed, number)), max_length, models)
+    failures = check_case(config, message, tables)
+    if not failures:
+        return None
+    names = set(name for name, _ in failures)
+    fails = lambda c, m: bool(names & set(name for name, _ in check_case(c, m, tables)))
+    config, message = shrink(config, message, fails)
+    return {"case": number, "config": config, "message": message,
+            "failures": [[name, got] for name, got in check_case(config, message, tables)]}
+
+"""
+Takes in a number of cases and a seed, and runs that many random cases,
+in a pool of processes if asked for more than one, checking the period
+table on every table_every-th case.  Returns the minimal failing cases,
+reporting progress on stderr.
+"""
+def differential_test(cases, seed=0, max_length=300, models=None, processes=1, table_every=50):
+    jobs = [(seed, number, max_length, models, table_every and number % table_every == 0)
+            for number in range(cases)]
+    failing, start_time = [], time.time()
+    for done, result in enumerate(pool_imap(run_case, jobs, processes, chunksize=64), 1):
+        if result is not None:
+            failing.append(result)
+        if done % 1000 == 0 or done == cases:
+            print("%d/%d cases done after %.1fs, %d failing" % (done, cases, time.time() - start_time,
+                  len(failing)), file=sys.stderr)
+    return failing
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the fast Enigma engines against the reference one.")
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--seed", default="0", help="cases are reproducible from the seed and case number")
+    parser.add_argument("--max-length", type=int, default=300, help="longest random message")
+    parser.add_argument("--model", action="append", choices=sorted(MACHINES), help="only use these models")
+    parser.add_argument("--table-every", type=int, default=50,
+                        help="check the period table on every this many cases (0 never)")
+    parser.add_argument("--processes", type=int, default=0, help="worker processes (0 for one per core)")
+    args = parser.parse_args()
+    failing = differential_test(args.cases, args.seed, args.max_length, args.model, args.processes or None,
+                                args.table_every)
+    for result in failing:
+        print(json.dumps(result))
+    if failing:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,18 @@ Authors: Robbie Young, Antonio Marino
 Initially implemented by David Liben-Nowell
 """
 
+import os
+import re
+import sys
 import time
 
 import argparse
-from email import message
-from heapq import merge
-from mimetypes import init
-from operator import mod
-from re import A
-import this
-from tracemalloc import start
+from contextlib import contextmanager
+from itertools import chain, cycle
+from multiprocessing import Pool
+from operator import add
 from substitution_ciphers import ltr2int, int2ltr, ALPHABET
+from catalog import write_catalog, merge_catalogs, position_index
 
 # Details on the rotors as listed here are from a variety of online
 # sources.  Rotor details come from Tony Sale's Codes and Ciphers.
@@ -33,7 +34,16 @@ ROTOR_PERMUTATIONS = {
     "III" :       "BDFHJLCPRTXVZNYEIWGAKMUSQO",
     "IV"  :       "ESOVPZJAYQUIRHXLNFTGKDCMWB",
     "V"   :       "VZBRGITYUPSDNHLXAWMJQOFECK",
+    "VI"  :       "JPGVOUMFYQBENHZRDKASXLICTW",
+    "VII" :       "NZJHGRCXMYSWBOUFAIVLPEKQDT",
+    "VIII":       "FKQHTLXOCBJSPDZRAMEWNIUYGV",
     "reflector" : "YRUHQSLDPXNGOKMIEBFZCWVJAT",
+    "B"   :       "YRUHQSLDPXNGOKMIEBFZCWVJAT", # the same as "reflector"
+    "C"   :       "FVPJIAOYEDRZXWGCTKUQSBNMHL",
+    "B-thin" :    "ENKQAUYWJICOPBLMDXZVFTHRGS", # M4 thin reflectors, which
+    "C-thin" :    "RDOBJNTKVEHMLFCWZAXGYIPSUQ", #    leave room for a fourth
+    "beta"  :     "LEYJVCNIXWPBQMDRTAKZGFUHOS", #    wheel that never steps
+    "gamma" :     "FSOKANUERHMBTIYCWLQPZXVGJD",
     "plugboard" : "ABCDEFGHIJKLMNOPQRSTUVWXYZ" # Question 1
 }
 
@@ -43,67 +53,66 @@ ROTOR_TURNOVERS = {
     "III" :       "W",  #    its neighbor on E -> F, III on V -> W, etc.
     "IV"  :       "K",  # Royal Flags Wave Kings Above!   
     "V"   :       "A",  # 
+    "VI"  :       "AN", # the naval rotors have two notches, stepping
+    "VII" :       "AN", #    their neighbor on both Z -> A and M -> N
+    "VIII":       "AN", #
     "reflector" :  "",   # (reflectors never rotate)
+    "B"   :       "",
+    "C"   :       "",
+    "B-thin" :    "",
+    "C-thin" :    "",
+    "beta"  :     "",   # (nor does the fourth wheel)
+    "gamma" :     "",
     "plugboard" : "" # Question 1
 }
 
-# Question 1
-PLUGBOARD_MAPPING = {
-    "A" : "A", "B" : "B", "C" : "C", "D" : "D", "E" : "E",
-    "F" : "F", "G" : "G", "H" : "H", "I" : "I", "J" : "J",
-    "K" : "K", "L" : "L", "M" : "M", "N" : "N", "O" : "O",
-    "P" : "P", "Q" : "Q", "R" : "R", "S" : "S", "T" : "T",
-    "U" : "U", "V" : "V", "W" : "W", "X" : "X", "Y" : "Y", "Z" : "Z"
+# The machines the code knows about: the rotors that go in the three
+# stepping slots, the reflectors, and for the M4, the fourth wheels that
+# sit between the slow rotor and the thin reflector.  A reflector is
+# named by a reflector spec: a reflector's name, or for the M4, the thin
+# reflector, the fourth wheel and its ring setting and window letter,
+# separated by commas, as in "B-thin,beta,AQ".  Since the fourth wheel
+# never steps, it and the thin reflector together are just another
+# reflector, and compile to a single table (see compile_reflector).
+MACHINES = {
+    "Enigma I" : {"rotors" : ["I", "II", "III", "IV", "V"],
+                  "reflectors" : ["B", "C"], "fourth_wheels" : []},
+    "M3" :       {"rotors" : ["I", "II", "III", "IV", "V", "VI", "VII", "VIII"],
+                  "reflectors" : ["B", "C"], "fourth_wheels" : []},
+    "M4" :       {"rotors" : ["I", "II", "III", "IV", "V", "VI", "VII", "VIII"],
+                  "reflectors" : ["B-thin", "C-thin"], "fourth_wheels" : ["beta", "gamma"]},
 }
 
 # Question 1
 """
-Takes in a dictionary of already existing plugboard 
-mappings, and a list of lists, where each sublist 
-contains two different characters of which the swap 
-is to be performed on.
-"""
-def perform_swaps_on_two_chars(PLUGBOARD_MAPPING, swaps):
-    for swap in swaps:
-        PLUGBOARD_MAPPING[swap[0]] = swap[1]
-        PLUGBOARD_MAPPING[swap[1]] = swap[0]
-    return PLUGBOARD_MAPPING
-
-# Question 1
-"""
-Takes in a string representing the mapping of letters 
-in the alphabet if the plugboard was a rotor, as well 
-as a dictionary of already exisitng plugboard mappings
+Takes in a list of pairs of letters to swap, and returns the plugboard
+as a tuple of 26 letter indices.  Every machine builds its own, and
+nothing ever modifies one, so machines never share plugboard state.
 """
-def modify_letter_perm(initial_perm, PLUGBOARD_MAPPING):
-    modified_list = []
-    for character in initial_perm:
-        modified_list.append(PLUGBOARD_MAPPING[character])
-    return modified_list
+def plugboard_table(plugboard_pairs):
+    plugs = list(range(26))
+    for a, b in plugboard_pairs:
+        a, b = ltr2int(a), ltr2int(b)
+        if a == b or plugs[a] != a or plugs[b] != b:
+            raise ValueError("plugboard pairs %s use a letter twice" % (plugboard_pairs,))
+        plugs[a], plugs[b] = b, a
+    return tuple(plugs)
 
-# Question 1
-"""
-Takes in a dictionary of already exisitng plugboard 
-mappings, a string representing the mapping of letters 
-in the alphabet if the plugboard was a rotor, and a 
-list of lists, where each sublist contains two 
-different characters of which the swaps are to be 
-performed on.
-"""
-def plugboard_swaps(PLUGBOARD_MAPPING, initial_perm, swaps):
-    PLUGBOARD_MAPPING = perform_swaps_on_two_chars(PLUGBOARD_MAPPING, swaps)
-    modified_list = modify_letter_perm(initial_perm, PLUGBOARD_MAPPING)
-    return modified_list
+IDENTITY_PLUGS = tuple(range(26))
 
 class Rotor:
     def __init__(self, name, ring_setting, initial_window_setting):
         self.perm = ROTOR_PERMUTATIONS[name]
         if name == "plugboard": # Question 1
-            self.perm = list(ROTOR_PERMUTATIONS[name])
-            self.perm = plugboard_swaps(PLUGBOARD_MAPPING, self.perm, ring_setting)
-            self.perm = "".join(self.perm)
+            self.perm = "".join(map(int2ltr, plugboard_table(ring_setting)))
         self.notches = ROTOR_TURNOVERS[name]
+        self.notch_positions = set((ltr2int(ch) - 1) % 26 for ch in self.notches)
         self.position = ltr2int(initial_window_setting)
+        # The ring setting (Ringstellung) turns the wiring against the
+        # lettered ring, so the wiring sits self.ring places behind the
+        # letter in the window; the notch is on the ring, so it still
+        # goes by the window letter.
+        self.ring = 0 if name == "plugboard" else ltr2int(ring_setting)
 
         # We'll also need the inverse permutation for the letters
         # coming back through this rotor.  E.g., the inverse of
@@ -128,26 +137,250 @@ class Rotor:
         '''Reports whether the rotor is sitting in a notch position, 
            aka if we and our left-hand neighbor should step on the 
            next move.'''
-        return int2ltr((self.position + 1) % 26) in self.notches
+        return self.position in self.notch_positions
 
     def encode(self, ch, inverted=False):
         '''Transforms ch by the rotor's permutation (or its inverse).'''
-        incoming = (ltr2int(ch) + self.position) % 26
+        shift = self.position - self.ring
+        incoming = (ltr2int(ch) + shift) % 26
         if not inverted:
-            out = (ltr2int(self.perm[incoming]) - self.position) % 26
+            out = (ltr2int(self.perm[incoming]) - shift) % 26
         else:
-            out = (ltr2int(self.inverse[incoming]) - self.position) % 26
+            out = (ltr2int(self.inverse[incoming]) - shift) % 26
         return int2ltr(out)
 
+"""
+Takes in the name of a rotor and its ring setting, and returns its flat
+integer tables: the forward and inverse wirings, indexed by window
+position * 26 + letter, and a list of 26 booleans saying whether the
+rotor is in its notch at each window position.  A ring setting only
+turns the wiring against the window letters, so its tables are those of
+ring setting A rotated by that many rows.  Tables are built once per
+rotor name and ring setting, and shared.
+"""
+COMPILED_ROTORS = {}
+def compile_rotor(name, ring_setting="A"):
+    if (name, ring_setting) not in COMPILED_ROTORS:
+        if ring_setting != "A":
+            forward_table, inverse_table, notch = compile_rotor(name)
+            shift = (-ltr2int(ring_setting)) % 26 * 26
+            COMPILED_ROTORS[(name, ring_setting)] = (forward_table[shift:] + forward_table[:shift],
+                                                     inverse_table[shift:] + inverse_table[:shift], notch)
+            return COMPILED_ROTORS[(name, ring_setting)]
+        perm = [ltr2int(ch) for ch in ROTOR_PERMUTATIONS[name]]
+        inverse = [0] * 26
+        for i in range(26):
+            inverse[perm[i]] = i
+        forward_table, inverse_table = [], []
+        for position in range(26):
+            for letter in range(26):
+                forward_table.append((perm[(letter + position) % 26] - position) % 26)
+                inverse_table.append((inverse[(letter + position) % 26] - position) % 26)
+        notch = [int2ltr(position + 1) in ROTOR_TURNOVERS[name] for position in range(26)]
+        COMPILED_ROTORS[(name, ring_setting)] = (forward_table, inverse_table, notch)
+    return COMPILED_ROTORS[(name, ring_setting)]
+
+"""
+Takes in a reflector spec, and returns the reflector's name, and the
+fourth wheel's name, ring setting and window letter (None, "A", "A"
+if there is no fourth wheel)
+"""
+def reflector_parts(reflector):
+    parts = reflector.split(",")
+    if len(parts) == 1:
+        return reflector, None, "A", "A"
+    name, wheel, setting = parts
+    return name, wheel, setting[0], setting[1]
+
+"""
+Takes in a reflector spec, and returns the reflector as a list of 26
+letter indices.  With a fourth wheel, the entry is what a letter comes
+back as after passing the wheel, the thin reflector, and the wheel
+backwards, which is fixed since the wheel never steps.
+"""
+COMPILED_REFLECTORS = {}
+def compile_reflector(reflector):
+    if reflector not in COMPILED_REFLECTORS:
+        name, wheel, ring_setting, window = reflector_parts(reflector)
+        reflect = compile_rotor(name)[0][:26]
+        if wheel is not None:
+            wheel_fwd, wheel_inv, _ = compile_rotor(wheel, ring_setting)
+            offset = ltr2int(window) * 26
+            reflect = [wheel_inv[offset + reflect[wheel_fwd[offset + c]]] for c in range(26)]
+        COMPILED_REFLECTORS[reflector] = reflect
+    return COMPILED_REFLECTORS[reflector]
+
+"""
+Takes in a rotor order, with or without a reflector spec after the
+three rotors, and returns the reflector spec ("B" if there is none)
+"""
+def order_reflector(rotor_perm):
+    return rotor_perm[3] if len(rotor_perm) > 3 else "B"
+
+"""
+Takes in a configuration [slow, medi, fast, plugboard_pairs,
+ring_setting, initial_position], optionally with a reflector spec at
+the end, and returns its seven fields, the reflector defaulting to "B"
+"""
+def config_fields(config):
+    return tuple(config[:6]) + (config[6] if len(config) > 6 else "B",)
+
+"""
+Takes in the name and ring setting of the fast rotor and a plugboard
+table, and returns the fast rotor's tables with the plugboard folded
+in: entry[p * 26 + c] is where the plugboard and then the rotor at
+position p send c, and exit[p * 26 + c] where the rotor's inverse and
+then the plugboard send it.  The plugboard only ever sits next to the
+fast rotor, so this takes two lookups off every letter.  Tables are
+cached for the most recent plugboards.
+"""
+PLUGGED_TABLES = {}
+def plugged_tables(fast, ring_setting, plugs):
+    forward_table, inverse_table, _ = compile_rotor(fast, ring_setting)
+    if plugs == IDENTITY_PLUGS:
+        return forward_table, inverse_table
+    key = (fast, ring_setting, plugs)
+    tables = PLUGGED_TABLES.get(key)
+    if tables is None:
+        if len(PLUGGED_TABLES) >= 256:
+            PLUGGED_TABLES.clear()
+        tables = PLUGGED_TABLES[key] = ([forward_table[offset + plugs[c]] for offset in range(0, 676, 26)
+                                         for c in range(26)], [plugs[c] for c in inverse_table])
+    return tables
+
+"""
+Takes in a configuration [slow, medi, fast, plugboard_pairs,
+ring_setting, initial_position], optionally with a reflector spec at
+the end, and returns the tables the compiled engines encipher with:
+slow_fwd, slow_inv, medi_fwd, medi_inv, the fast rotor's tables with
+the plugboard folded in (see plugged_tables), and the reflector
+"""
+def machine_tables(config):
+    slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector = config_fields(config)
+    slow_fwd, slow_inv, _ = compile_rotor(slow, ring_setting[0])
+    medi_fwd, medi_inv, _ = compile_rotor(medi, ring_setting[1])
+    fast_entry, fast_exit = plugged_tables(fast, ring_setting[2], plugboard_table(plugboard_pairs))
+    return slow_fwd, slow_inv, medi_fwd, medi_inv, fast_entry, fast_exit, compile_reflector(reflector)
+
+# Window positions are numbered 0, ..., 26^3 - 1 as slow * 676 + medi * 26
+# + fast; these give each rotor's table offset (position * 26) for each.
+POSITIONS = 26 ** 3
+SLOW_OFFSETS = [p // 676 * 26 for p in range(POSITIONS)]
+MEDI_OFFSETS = [p // 26 % 26 * 26 for p in range(POSITIONS)]
+FAST_OFFSETS = [p % 26 * 26 for p in range(POSITIONS)]
+
+"""
+Takes in the names of the middle and fast rotors, and returns a list
+giving, for every window position, the position one keystroke later.
+The slow rotor never pushes anything, so one table per pair of middle
+and fast rotors covers every rotor order; each is built once.
+"""
+STEPPING_TABLES = {}
+def stepping_table(medi, fast):
+    if (medi, fast) not in STEPPING_TABLES:
+        medi_notch, fast_notch = compile_rotor(medi)[2], compile_rotor(fast)[2]
+        next_position = []
+        for s in range(26):
+            for m in range(26):
+                for f in range(26):
+                    if medi_notch[m]:
+                        next_s, next_m = (s + 1) % 26, (m + 1) % 26
+                    elif fast_notch[f]:
+                        next_s, next_m = s, (m + 1) % 26
+                    else:
+                        next_s, next_m = s, m
+                    next_position.append((next_s * 26 + next_m) * 26 + (f + 1) % 26)
+        STEPPING_TABLES[(medi, fast)] = next_position
+    return STEPPING_TABLES[(medi, fast)]
+
+"""
+Takes in the names of the middle and fast rotors and a starting
+position, and returns the window positions after keystrokes 1, 2, ...
+up to the first repeat, along with the index at which the repeating
+loop begins.  A start position that the lever logic can never come
+back to (e.g. a middle rotor sitting in its notch) leads into the
+loop after a keystroke or two; after that the motion repeats every
+26 * 25 * 26 keystrokes (less for the two-notch rotors, whose
+positions split into several shorter loops).  So after keystroke k >= 1 the machine is at
+entry k - 1, or, past the end, at loop_start + (k - 1 - loop_start)
+modulo the loop length.  Sequences are cached per start position.
+"""
+STEPPING_SEQUENCES = {}
+def stepping_sequence(medi, fast, initial_position):
+    key = (medi, fast, initial_position)
+    found = STEPPING_SEQUENCES.get(key)
+    if found is None:
+        next_position = stepping_table(medi, fast)
+        sequence, seen = [], {}
+        position = next_position[position_index(initial_position)]
+        while position not in seen:
+            seen[position] = len(sequence)
+            sequence.append(position)
+            position = next_position[position]
+        if len(STEPPING_SEQUENCES) >= 256:
+            STEPPING_SEQUENCES.clear()
+        found = STEPPING_SEQUENCES[key] = (sequence, seen[position])
+    return found
+
+"""
+Takes in a window position number, and returns the three letters
+showing in the windows
+"""
+def position_name(position):
+    return int2ltr(position // 676) + int2ltr(position // 26) + int2ltr(position)
+
 def enigma(slow, medi, fast,
-           plugboard_pairs, ring_setting, initial_position):
+           plugboard_pairs, ring_setting, initial_position, reflector="B", compiled=True):
     slowR = Rotor(slow, ring_setting[0], initial_position[0])
     mediR = Rotor(medi, ring_setting[1], initial_position[1])
     fastR = Rotor(fast, ring_setting[2], initial_position[2])
-    reflector  = Rotor("reflector", "A", "A")
+    reflector_name, wheel, wheel_ring, wheel_window = reflector_parts(reflector)
+    fourth = [Rotor(wheel, wheel_ring, wheel_window)] if wheel else [] # M4 only
+    reflectorR = Rotor(reflector_name, "A", "A")
     plugboard = Rotor("plugboard", plugboard_pairs, "A") # Question 1
-                
+
+    # Integer tables for the compiled engine, looked up once per machine.
+    slow_fwd, slow_inv, medi_fwd, medi_inv, fast_entry, fast_exit, reflect = machine_tables(
+        [slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector])
+    fast_exit_letters = [ALPHABET[c] for c in fast_exit]
+    next_position = stepping_table(medi, fast)
+    # the trace shows the plugboard, the bare fast rotor, and the fourth
+    # wheel and thin reflector separately
+    plugs = plugboard_table(plugboard_pairs)
+    fast_fwd, fast_inv, _ = compile_rotor(fast, ring_setting[2])
+    turnaround = [(compile_rotor(reflector_name)[0], 0)]
+    if wheel:
+        wheel_fwd, wheel_inv, _ = compile_rotor(wheel, wheel_ring)
+        turnaround = [(wheel_fwd, ltr2int(wheel_window) * 26)] + turnaround + [(wheel_inv, ltr2int(wheel_window) * 26)]
+
+    def encipher_compiled(message, debug):
+        '''Enciphers message with pure index arithmetic, leaving the
+           rotors where the traced version would have left them, and
+           building the same trace if asked for one.'''
+        position = (slowR.position * 26 + mediR.position) * 26 + fastR.position
+        output, windows, transformations = [], [position_name(position)], []
+        for ch in message:
+            position = next_position[position]
+            so, mo, fo = SLOW_OFFSETS[position], MEDI_OFFSETS[position], FAST_OFFSETS[position]
+            if debug:
+                trace = [plugs[(ord(ch.upper()) - 65) % 26]]
+                for table, offset in [(fast_fwd, fo), (medi_fwd, mo), (slow_fwd, so)] + turnaround + [
+                                      (slow_inv, so), (medi_inv, mo), (fast_inv, fo)]:
+                    trace.append(table[offset + trace[-1]])
+                windows.append(position_name(position))
+                transformations.append(ch + " => " + " -> ".join(ALPHABET[t] for t in trace) + "\n")
+                output.append(ALPHABET[plugs[trace[-1]]])
+            else:
+                c = slow_fwd[so + medi_fwd[mo + fast_entry[fo + (ord(ch.upper()) - 65) % 26]]]
+                output.append(fast_exit_letters[fo + medi_inv[mo + slow_inv[so + reflect[c]]]])
+        slowR.position, mediR.position, fastR.position = position // 676, position // 26 % 26, position % 26
+        if debug:
+            return "".join(output), " ".join(windows), "".join(transformations)
+        return "".join(output)
+
     def encipher(message, debug=False):
+        if compiled:
+            return encipher_compiled(message, debug)
         output = ""
         windows, transformations = ["%s%s%s" % (slowR,mediR,fastR)], ""
         for ch in message:
@@ -162,10 +395,10 @@ def enigma(slow, medi, fast,
             transformations = transformations + " => " + ch
 
             windows.append("%s%s%s" % (slowR,mediR,fastR))
-            for rotor in [fastR, mediR, slowR, reflector]:
+            for rotor in [fastR, mediR, slowR] + fourth + [reflectorR]:
                 ch = rotor.encode(ch)
                 transformations = transformations + " -> " + ch
-            for rotor in [slowR, mediR, fastR]:
+            for rotor in fourth + [slowR, mediR, fastR]:
                 ch = rotor.encode(ch, inverted=True)
                 transformations = transformations + " -> " + ch
             ch = plugboard.encode(ch) # Question 1
@@ -176,6 +409,218 @@ def enigma(slow, medi, fast,
         return output
     return encipher
 
+"""
+Takes in Enigma settings and returns the substitutions used on every
+keystroke until the rotor motion repeats, packed as bytes: entry
+k * 26 + c is the (upper case ASCII) letter that letter c becomes on
+keystroke k + 1, plugboard included.  That is a full period, at most
+26 * 25 * 26 keystrokes (about 440 KB), plus any lead-in from the start
+position.  Also returns the keystroke index where the repeat begins.
+"""
+def period_table(slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector="B"):
+    slow_fwd, slow_inv, medi_fwd, medi_inv, fast_entry, fast_exit, reflect = machine_tables(
+        [slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector])
+    sequence, loop_start = stepping_sequence(medi, fast, initial_position)
+    table = bytearray()
+    for position in sequence:
+        so, mo, fo = SLOW_OFFSETS[position], MEDI_OFFSETS[position], FAST_OFFSETS[position]
+        for c in range(26):
+            c = slow_fwd[so + medi_fwd[mo + fast_entry[fo + c]]]
+            table.append(65 + fast_exit[fo + medi_inv[mo + slow_inv[so + reflect[c]]]])
+    return bytes(table), loop_start
+
+"""
+Takes in a table and loop start built by period_table, and returns a
+function that enciphers a message from the table's starting position
+with a single lookup per letter.  Unlike enigma(), every call starts
+afresh from the daily key, so one table serves any number of messages.
+"""
+def table_enigma(table, loop_start):
+    lead_rows, loop_rows = range(0, loop_start * 26, 26), range(loop_start * 26, len(table), 26)
+    def encipher(message):
+        codes = [(ord(ch.upper()) - 65) % 26 for ch in message]
+        rows = chain(lead_rows, cycle(loop_rows))
+        return bytes(map(table.__getitem__, map(add, rows, codes))).decode("ascii")
+    return encipher
+
+"""
+Takes in a rotor order, ring setting and reflector spec, and returns
+the substitution the rotors and reflector make (no plugboard) at every
+window position, as a list where entry position * 26 + c is what letter
+c becomes with the rotors at that position.  About 457,000 entries; attacks that sweep
+every position of an order build it once and index into it.
+"""
+def scrambler_table(slow, medi, fast, ring_setting="AAA", reflector="B"):
+    slow_fwd, slow_inv, _ = compile_rotor(slow, ring_setting[0])
+    medi_fwd, medi_inv, _ = compile_rotor(medi, ring_setting[1])
+    fast_fwd, fast_inv, _ = compile_rotor(fast, ring_setting[2])
+    reflect = compile_reflector(reflector)
+    # the slow rotor and reflector together, for each slow rotor position
+    turnaround = [slow_inv[so + reflect[slow_fwd[so + c]]] for so in range(0, 676, 26) for c in range(26)]
+    table = []
+    for so in range(0, 676, 26):
+        for mo in range(0, 676, 26):
+            for fo in range(0, 676, 26):
+                table.extend([fast_inv[fo + medi_inv[mo + turnaround[so + medi_fwd[mo + fast_fwd[fo + c]]]]]
+                              for c in range(26)])
+    return table
+
+"""
+Takes in the names of the middle and fast rotors, a starting position
+and a number of keystrokes n, and returns the window positions after
+each of the n keystrokes as three lists of table offsets (position * 26)
+for the slow, middle and fast rotors.
+"""
+def stepping_offsets(medi, fast, initial_position, n):
+    next_position = stepping_table(medi, fast)
+    position = position_index(initial_position)
+    positions = []
+    for k in range(n):
+        position = next_position[position]
+        positions.append(position)
+    return ([SLOW_OFFSETS[p] for p in positions], [MEDI_OFFSETS[p] for p in positions],
+            [FAST_OFFSETS[p] for p in positions])
+
+"""
+Takes in a configuration [slow, medi, fast, plugboard_pairs, ring_setting,
+initial_position] and a list of letter indices, and enciphers them from
+the configuration's start position one stage at a time: each rotor is
+applied to the whole message as a gather through map() instead of
+letter by letter.  Precomputed stepping offsets may be passed in when
+several messages share a key.  Returns a list of letter indices.
+"""
+def encipher_codes(config, codes, offsets=None):
+    slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector = config_fields(config)
+    if offsets is None:
+        offsets = stepping_offsets(medi, fast, initial_position, len(codes))
+    slow_offsets, medi_offsets, fast_offsets = offsets
+    slow_fwd, slow_inv, medi_fwd, medi_inv, fast_entry, fast_exit, reflect = machine_tables(config)
+
+    c = map(fast_entry.__getitem__, map(add, fast_offsets, codes))
+    c = map(medi_fwd.__getitem__, map(add, medi_offsets, c))
+    c = map(slow_fwd.__getitem__, map(add, slow_offsets, c))
+    c = map(reflect.__getitem__, c)
+    c = map(slow_inv.__getitem__, map(add, slow_offsets, c))
+    c = map(medi_inv.__getitem__, map(add, medi_offsets, c))
+    return list(map(fast_exit.__getitem__, map(add, fast_offsets, c)))
+
+"""
+Takes in a list of configurations and a message, and returns the list
+of encipherments of that message under each configuration.
+"""
+def enigma_batch(configs, message):
+    codes = [(ord(ch.upper()) - 65) % 26 for ch in message]
+    return ["".join(map(ALPHABET.__getitem__, encipher_codes(config, codes)))
+            for config in configs]
+
+"""
+Takes in a configuration and a list of messages, and returns the list
+of their encipherments, each message starting from the configuration's
+start position.  The stepping is worked out once for the longest message.
+"""
+def enigma_messages(config, messages):
+    codes_list = [[(ord(ch.upper()) - 65) % 26 for ch in message] for message in messages]
+    longest = max([len(codes) for codes in codes_list], default=0)
+    offsets = stepping_offsets(config[1], config[2], config[5], longest)
+    return ["".join(map(ALPHABET.__getitem__, encipher_codes(config, codes, offsets)))
+            for codes in codes_list]
+
+class EnigmaStream:
+    '''An Enigma machine as a stream: feed() enciphers text a chunk at a
+       time, carrying the rotor positions over, like the function
+       enigma() returns, but the positions are out in the open.
+       state() snapshots them as a dictionary of plain values (it
+       survives JSON), restore() puts a snapshot back, and seek(n)
+       jumps straight to where the rotors are after n keystrokes from
+       the start, using the stepping sequence of stepping_sequence()
+       instead of stepping n times.'''
+
+    def __init__(self, slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector="B"):
+        self.config = [slow, medi, fast, [tuple(pair) for pair in plugboard_pairs], ring_setting,
+                       initial_position, reflector]
+        (self.slow_fwd, self.slow_inv, self.medi_fwd, self.medi_inv, self.fast_entry, fast_exit,
+         self.reflect) = machine_tables(self.config)
+        self.fast_exit_letters = [ALPHABET[c] for c in fast_exit]
+        self.next_position = stepping_table(medi, fast)
+        self.start = position_index(initial_position)
+        self.position, self.keystrokes = self.start, 0
+
+    def __repr__(self):
+        '''Returns the letters showing in the windows.'''
+        return position_name(self.position)
+
+    def feed(self, chunk):
+        '''Enciphers chunk, each character a keystroke as with
+           enigma(), and returns the result.'''
+        slow_fwd, slow_inv, medi_fwd, medi_inv = self.slow_fwd, self.slow_inv, self.medi_fwd, self.medi_inv
+        fast_entry, fast_exit_letters, reflect = self.fast_entry, self.fast_exit_letters, self.reflect
+        next_position, position, output = self.next_position, self.position, []
+        for ch in chunk:
+            position = next_position[position]
+            so, mo, fo = SLOW_OFFSETS[position], MEDI_OFFSETS[position], FAST_OFFSETS[position]
+            c = slow_fwd[so + medi_fwd[mo + fast_entry[fo + (ord(ch.upper()) - 65) % 26]]]
+            output.append(fast_exit_letters[fo + medi_inv[mo + slow_inv[so + reflect[c]]]])
+        self.position, self.keystrokes = position, self.keystrokes + len(chunk)
+        return "".join(output)
+
+    def tell(self):
+        '''Returns the number of keystrokes since the start.'''
+        return self.keystrokes
+
+    def seek(self, n):
+        '''Moves the rotors to where they are after n keystrokes from
+           the start.  Past the stepping sequence's lead-in the motion
+           goes round a loop, so any n is one lookup.'''
+        if n < 0:
+            raise ValueError("cannot seek to keystroke %d" % n)
+        if n == 0:
+            self.position = self.start
+        else:
+            sequence, loop_start = stepping_sequence(self.config[1], self.config[2], self.config[5])
+            index = n - 1
+            if index >= len(sequence):
+                index = loop_start + (index - loop_start) % (len(sequence) - loop_start)
+            self.position = sequence[index]
+        self.keystrokes = n
+
+    def state(self):
+        '''Returns a snapshot of the machine: its configuration, the
+           keystrokes typed and the letters in the windows.'''
+        return {"config": self.config[:3] + [[list(pair) for pair in self.config[3]]] + self.config[4:],
+                "keystrokes": self.keystrokes, "position": position_name(self.position)}
+
+    def restore(self, state):
+        '''Puts back a snapshot taken by state(), rebuilding the machine
+           first if the snapshot is of another configuration.'''
+        config = state["config"][:3] + [[tuple(pair) for pair in state["config"][3]]] + state["config"][4:]
+        if config != self.config:
+            self.__init__(*config)
+        self.position = position_index(state["position"])
+        self.keystrokes = state["keystrokes"]
+
+"""
+enciphers one segment of a long message for enigma_segments, from a
+machine seeked to the segment's first keystroke
+"""
+def encipher_segment(args):
+    config, offset, text = args
+    stream = EnigmaStream(*config_fields(config))
+    stream.seek(offset)
+    return stream.feed(text)
+
+"""
+Takes in a configuration and a long message, and enciphers it from the
+configuration's start position in segments, each in a pool of processes
+(one per core unless told otherwise, and none if told one) that seeks
+its own machine to where the segment starts.  Returns the same as
+enigma(*config)(message).
+"""
+def enigma_segments(config, message, segments=None, processes=None):
+    segments = segments or os.cpu_count() or 1
+    size = -(-len(message) // segments) or 1
+    jobs = [(config, start, message[start:start + size]) for start in range(0, len(message), size)]
+    return "".join(pool_imap(encipher_segment, jobs, processes))
+
 # Question 2
 """
 Takes in an already ordered list, and two 
@@ -337,28 +782,93 @@ def convert_to_lengths(cycles_list):
 
 # Question 2
 """
-Takes in Enigma settings, and computes the signature
+Takes in Enigma settings, and computes the signature by
+assembling cycles out of chains of letters
 """
-def compute_signature(slow, medi, fast, plugboard_pairs, ring_setting, initial_position):
+def compute_signature_from_chains(slow, medi, fast, plugboard_pairs, ring_setting, initial_position):
     list_of_cycles = gen_cycle_chains(slow, medi, fast, plugboard_pairs, ring_setting, initial_position)
     cycles_list = combine_chains(list_of_cycles)
     lengths_list = convert_to_lengths(cycles_list)
     return tuple(merge_sort(lengths_list))
 
+"""
+Takes in Enigma settings and a list of keystroke numbers (counting
+from 1), and returns the permutation of {0, ..., 25} the machine
+applies on each of those keystrokes, built from one set of tables.
+"""
+def keystroke_permutations(slow, medi, fast, plugboard_pairs, ring_setting, initial_position, keystrokes, reflector="B"):
+    slow_fwd, slow_inv, medi_fwd, medi_inv, fast_entry, fast_exit, reflect = machine_tables(
+        [slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector])
+    slow_offsets, medi_offsets, fast_offsets = stepping_offsets(medi, fast, initial_position, max(keystrokes))
+    perms = []
+    for k in keystrokes:
+        so, mo, fo = slow_offsets[k - 1], medi_offsets[k - 1], fast_offsets[k - 1]
+        perm = []
+        for c in range(26):
+            c = slow_fwd[so + medi_fwd[mo + fast_entry[fo + c]]]
+            perm.append(fast_exit[fo + medi_inv[mo + slow_inv[so + reflect[c]]]])
+        perms.append(perm)
+    return perms
+
+"""
+Takes in a permutation of {0, ..., 25} as a list, and returns the
+lengths of its cycles, longest first, visiting each letter once
+"""
+def cycle_lengths(perm):
+    seen, lengths = [False] * 26, []
+    for start in range(26):
+        length, i = 0, start
+        while not seen[i]:
+            seen[i] = True
+            i = perm[i]
+            length += 1
+        if length:
+            lengths.append(length)
+    return tuple(sorted(lengths, reverse=True))
+
+"""
+Takes in Enigma settings, and computes the signature: the cycle
+lengths of the permutation taking the first enciphered letter of a
+doubled indicator to the fourth
+"""
+def compute_signature(slow, medi, fast, plugboard_pairs, ring_setting, initial_position, reflector="B"):
+    first, fourth = keystroke_permutations(slow, medi, fast, plugboard_pairs, ring_setting, initial_position, (1, 4),
+                                           reflector)
+    return cycle_lengths([fourth[c] for c in first])
+
 # Question 4
 """
 generates a list of lists representing possible 
-rotor permutations
+rotor permutations: of rotors I to V with reflector B, 
+or, given a model from MACHINES, of its rotors, with 
+each of its reflector specs after the three rotors
 """
-def gen_rotor_perms():
+def gen_rotor_perms(model=None):
     rotor_permutations, rotors = [], ['I','II','III','IV','V']
+    if model is not None:
+        rotors = MACHINES[model]["rotors"]
     for rotor_1 in rotors: 
         for rotor_2 in rotors:
             for rotor_3 in rotors:
                 if (rotor_1 != rotor_2) and (rotor_1 != rotor_3) and (rotor_2 != rotor_3):
                     rotor_permutations.append([rotor_1, rotor_2, rotor_3])
+    if model is not None:
+        rotor_permutations = [rotor_perm + [reflector] for rotor_perm in rotor_permutations
+                              for reflector in gen_reflectors(model)]
     return rotor_permutations
 
+"""
+Takes in a model from MACHINES, and returns its reflector specs: for
+the M4, every thin reflector with every fourth wheel at every window
+letter (the wheel never steps, so its ring setting can stay at A)
+"""
+def gen_reflectors(model):
+    machine = MACHINES[model]
+    if not machine["fourth_wheels"]:
+        return list(machine["reflectors"])
+    return [reflector + "," + wheel + ",A" + window for reflector in machine["reflectors"]
+            for wheel in machine["fourth_wheels"] for window in ALPHABET]
+
 # Question 4
 """
 generates a list of strings representing possible 
@@ -383,6 +893,147 @@ def gen_configs():
     rotor_permutations, starting_positions = gen_rotor_perms(), gen_starting_positions()
     return rotor_permutations, starting_positions
 
+# Ring settings multiply the configurations by 26^3, but most of them
+# are the same machine.  Each rotor's wiring sits at its window letter
+# minus its ring setting, and only the stepping goes by the window
+# letters, so two settings agree on every keystroke of an indicator as
+# long as the wiring offsets start equal and the rotors step on the same
+# keystrokes:
+#
+#   - the slow rotor never pushes anything, so its ring setting can
+#     always be folded into its window letter (ring A);
+#   - the fast rotor's ring only matters through the keystrokes on which
+#     its notch pushes the middle rotor, and at most a few of the 26
+#     ring settings differ in that over six keystrokes;
+#   - likewise the middle rotor's ring only matters through the
+#     keystrokes on which it steps itself and the slow rotor.
+#
+# The ring catalog keeps the first ring setting (in alphabetical order)
+# of every class, about 19 per wiring offset for rotors with one notch,
+# instead of 26^3.
+INDICATOR_KEYSTROKES = 6
+
+"""
+Takes in the names of the middle and fast rotors, and returns the ring
+settings of each equivalence class: fast_rings[o][events] lists, in
+order, the fast ring settings that put the fast wiring at offset o and
+push the middle rotor on exactly those keystrokes, and
+medi_rings[o, events][steps] does the same for the middle rotor, given
+the fast rotor's pushes, by the keystrokes on which it steps (and
+whether it takes the slow rotor along).  Built once per pair.
+"""
+RING_CLASSES = {}
+def ring_classes(medi, fast):
+    if (medi, fast) not in RING_CLASSES:
+        medi_notch, fast_notch = compile_rotor(medi)[2], compile_rotor(fast)[2]
+        fast_rings = [{} for offset in range(26)]
+        for offset in range(26):
+            for ring in range(26):
+                events = tuple(k for k in range(1, INDICATOR_KEYSTROKES + 1)
+                               if fast_notch[(offset + ring + k - 1) % 26])
+                fast_rings[offset].setdefault(events, []).append(ring)
+        medi_rings = {}
+        for offset in range(26):
+            for events in set(chain.from_iterable(fast_rings)):
+                classes = medi_rings[(offset, events)] = {}
+                for ring in range(26):
+                    window, steps = offset + ring, []
+                    for k in range(1, INDICATOR_KEYSTROKES + 1):
+                        if medi_notch[window % 26] or k in events:
+                            steps.append((k, medi_notch[window % 26]))
+                            window += 1
+                    classes.setdefault(tuple(steps), []).append(ring)
+        RING_CLASSES[(medi, fast)] = (fast_rings, medi_rings)
+    return RING_CLASSES[(medi, fast)]
+
+"""
+Takes in the names of the middle and fast rotors, and returns the
+(ring setting, starting position) pairs the ring catalog needs for any
+rotor order ending in them: one per equivalence class, sorted
+"""
+def canonical_settings(medi, fast):
+    fast_rings, medi_rings = ring_classes(medi, fast)
+    settings = []
+    for fast_offset in range(26):
+        for events, fast_class in fast_rings[fast_offset].items():
+            for medi_offset in range(26):
+                for medi_class in medi_rings[(medi_offset, events)].values():
+                    ring_setting = "A" + int2ltr(medi_class[0]) + int2ltr(fast_class[0])
+                    for slow_offset in range(26):
+                        settings.append((ring_setting, int2ltr(slow_offset) + int2ltr(medi_offset + medi_class[0])
+                                         + int2ltr(fast_offset + fast_class[0])))
+    return sorted(settings)
+
+"""
+Takes in a configuration, and returns the classes of ring settings
+it belongs to, as (slow offset, medi offset, medi class, fast offset,
+fast class), the classes being lists of ring settings
+"""
+def ring_class(config):
+    slow, medi, fast, plugboard_pairs, ring_setting, position, reflector = config_fields(config)
+    fast_rings, medi_rings = ring_classes(medi, fast)
+    slow_offset, medi_offset, fast_offset = [(ltr2int(position[i]) - ltr2int(ring_setting[i])) % 26 for i in range(3)]
+    fast_class = [rings for rings in fast_rings[fast_offset].values() if ltr2int(ring_setting[2]) in rings][0]
+    events = [events for events, rings in fast_rings[fast_offset].items() if rings is fast_class][0]
+    medi_class = [rings for rings in medi_rings[(medi_offset, events)].values()
+                  if ltr2int(ring_setting[1]) in rings][0]
+    return slow_offset, medi_offset, medi_class, fast_offset, fast_class
+
+"""
+Takes in a configuration, and returns the configuration the ring
+catalog lists for it: same rotors and plugboard, and the same
+encipherment of the first six letters of any message
+"""
+def canonical_config(config):
+    slow_offset, medi_offset, medi_class, fast_offset, fast_class = ring_class(config)
+    return config[:4] + ["A" + int2ltr(medi_class[0]) + int2ltr(fast_class[0]),
+                         int2ltr(slow_offset) + int2ltr(medi_offset + medi_class[0])
+                         + int2ltr(fast_offset + fast_class[0])] + config[6:]
+
+"""
+Takes in the names of the middle and fast rotors, and returns a
+numbering of the classes of equivalent ring settings for any rotor
+order ending in them, as (fast_numbers, medi_numbers, count):
+fast_numbers[fast offset * 26 + fast ring] numbers the fast rotor's
+class, and medi_numbers[that number][medi offset * 26 + medi ring]
+numbers the fast and middle classes together, from 0 to count - 1.
+A configuration's class is that number * 26 + its slow offset.  Built
+once per pair.
+"""
+CLASS_NUMBERS = {}
+def class_numbers(medi, fast):
+    if (medi, fast) not in CLASS_NUMBERS:
+        fast_rings, medi_rings = ring_classes(medi, fast)
+        fast_numbers, medi_numbers, count = [0] * 676, [], 0
+        for fast_offset in range(26):
+            for events, fast_class in fast_rings[fast_offset].items():
+                numbers = [0] * 676
+                for medi_offset in range(26):
+                    for medi_class in medi_rings[(medi_offset, events)].values():
+                        for ring in medi_class:
+                            numbers[medi_offset * 26 + ring] = count
+                        count += 1
+                for ring in fast_class:
+                    fast_numbers[fast_offset * 26 + ring] = len(medi_numbers)
+                medi_numbers.append(numbers)
+        CLASS_NUMBERS[(medi, fast)] = (fast_numbers, medi_numbers, count)
+    return CLASS_NUMBERS[(medi, fast)]
+
+"""
+Takes in a configuration, and yields every (ring setting, starting
+position) configuration that enciphers the first six letters of any
+message the same way, itself included.  This expands a ring catalog
+entry back into all the day keys it stands for.
+"""
+def equivalent_configs(config):
+    slow_offset, medi_offset, medi_class, fast_offset, fast_class = ring_class(config)
+    for slow_ring in range(26):
+        for medi_ring in medi_class:
+            for fast_ring in fast_class:
+                yield config[:4] + [int2ltr(slow_ring) + int2ltr(medi_ring) + int2ltr(fast_ring),
+                                    int2ltr(slow_offset + slow_ring) + int2ltr(medi_offset + medi_ring)
+                                    + int2ltr(fast_offset + fast_ring)] + config[6:]
+
 # Question 4
 """
 takes in a dictionary of signatures to configurations, 
@@ -398,13 +1049,15 @@ def add_config_to_sig(sig_to_config_dict, signature, config):
 # Question 4
 """
 Takes in a dictionary of signatures to configurations,
-a list representing a particular rotor permutation, and 
-a string representing a particular starting position; and 
-adds the corresponding signature, configuration key-value pair
+a list representing a particular rotor permutation, 
+a string representing a particular starting position and 
+optionally a ring setting; and adds the corresponding 
+signature, configuration key-value pair
 """
-def create_sig_to_config_dict(sig_to_config_dict, rotor_perm, starting_pos):
-    signature = compute_signature(rotor_perm[0], rotor_perm[1], rotor_perm[2], [], "AAA", starting_pos)
-    config = [rotor_perm[0], rotor_perm[1], rotor_perm[2], [], "AAA", starting_pos] 
+def create_sig_to_config_dict(sig_to_config_dict, rotor_perm, starting_pos, ring_setting="AAA"):
+    signature = compute_signature(rotor_perm[0], rotor_perm[1], rotor_perm[2], [], ring_setting, starting_pos,
+                                  order_reflector(rotor_perm))
+    config = [rotor_perm[0], rotor_perm[1], rotor_perm[2], [], ring_setting, starting_pos] + rotor_perm[3:]
     sig_to_config_dict = add_config_to_sig(sig_to_config_dict, signature, config)
     return sig_to_config_dict
 
@@ -446,8 +1099,369 @@ def sig_to_config_dictionary():
     write_to_sig_to_config_file(sig_to_config_dict)
     return
 
+"""
+computes the signature for a rotor permutation and a list of
+(ring setting, starting position) pairs
+"""
+def compute_sigs_for_settings(rotor_perm, settings):
+    sig_to_config_dict = {}
+    for ring_setting, starting_pos in settings:
+        sig_to_config_dict = create_sig_to_config_dict(sig_to_config_dict, rotor_perm, starting_pos, ring_setting)
+    return sig_to_config_dict
+
+"""
+splits the catalog work into shards, one list [rotor_perm, settings]
+per slice of the (ring setting, starting position) pairs for each rotor
+permutation, in the same order the serial builder visits them.  The
+settings for a rotor permutation are every starting position with each
+of ring_settings, or if settings_for is given, settings_for(rotor_perm).
+"""
+def gen_shards(rotor_permutations, starting_positions, shards_per_order, ring_settings=("AAA",), settings_for=None):
+    shards = []
+    for rotor_perm in rotor_permutations:
+        if settings_for is None:
+            settings = [(ring_setting, position) for ring_setting in ring_settings for position in starting_positions]
+        else:
+            settings = settings_for(rotor_perm)
+        size = -(-len(settings) // shards_per_order)
+        for start in range(0, len(settings), size):
+            shards.append([rotor_perm, settings[start:start + size]])
+    return shards
+
+"""
+splits the ring catalog work into shards: for each rotor permutation,
+the canonical (ring setting, starting position) pair of every class
+of equivalent settings
+"""
+def gen_ring_shards(rotor_permutations, shards_per_order):
+    return gen_shards(rotor_permutations, None, shards_per_order,
+                      settings_for=lambda rotor_perm: canonical_settings(rotor_perm[1], rotor_perm[2]))
+
+"""
+computes the signature to configuration dictionary for a single shard
+"""
+def compute_sigs_for_shard(shard):
+    return compute_sigs_for_settings(shard[0], shard[1])
+
+"""
+takes in a dictionary of signatures to configurations and the dictionary
+for one more shard, and appends the shard's configurations to it
+"""
+def merge_sig_to_config_dicts(sig_to_config_dict, shard_dict):
+    for signature in shard_dict:
+        if signature in sig_to_config_dict:
+            sig_to_config_dict[signature].extend(shard_dict[signature])
+        else:
+            sig_to_config_dict[signature] = shard_dict[signature]
+    return sig_to_config_dict
+
+"""
+Takes in a function, a list of jobs and a number of processes, and
+yields the function's result on each job in order: from a pool of
+processes (one per core if processes is None), or in this process if
+told one.  The pool is torn down when the results run out, or as soon
+as a job raises or the caller stops early.
+"""
+def pool_imap(function, jobs, processes=None, chunksize=1):
+    if processes == 1:
+        yield from map(function, jobs)
+        return
+    with Pool(processes) as pool:
+        yield from pool.imap(function, jobs, chunksize)
+
+"""
+generates the same dictionary as sig_to_config_dictionary, but shards
+the work across a pool of processes (one per core unless told otherwise,
+and none if told one).  Shards are merged in order, so the result, and the file it is written
+to, are identical to the serial build.  Progress goes to stderr.
+"""
+def parallel_sig_to_config_dictionary(processes=None, shards_per_order=1):
+    rotor_permutations, starting_positions = gen_configs()
+    shards = gen_shards(rotor_permutations, starting_positions, shards_per_order)
+    sig_to_config_dict, start_time = {}, time.time()
+    for done, shard_dict in enumerate(pool_imap(compute_sigs_for_shard, shards, processes), 1):
+        sig_to_config_dict = merge_sig_to_config_dicts(sig_to_config_dict, shard_dict)
+        print("shard %d/%d (%s) done after %.1fs" % (done, len(shards),
+              "/".join(shards[done - 1][0]), time.time() - start_time), file=sys.stderr)
+    write_to_sig_to_config_file(sig_to_config_dict)
+    return sig_to_config_dict
+
+"""
+takes in a checkpoint directory and a shard, and returns the name of
+the file the shard's signatures are checkpointed to
+"""
+def shard_filename(checkpoint_dir, shard):
+    rotor_perm, settings = shard
+    return os.path.join(checkpoint_dir, "%s_%s.%s-%s.%s.bin" % (("-".join(rotor_perm),) + settings[0] + settings[-1]))
+
+"""
+generates the catalog shard by shard, checkpointing every finished
+shard to checkpoint_dir in the binary catalog format, then merges all
+the shards into catalog_file without loading them all at once.  Shards
+already in checkpoint_dir are not recomputed, so an interrupted run
+resumes where it stopped, and running again with more rotor
+permutations only computes the new ones.  The rotor permutations
+default to those of the problem set's machine, or of model if given.  With rings, the catalog
+covers every ring setting, through one configuration per class of
+equivalent settings (see canonical_settings); about 334,000 per rotor
+permutation of one-notch rotors instead of 17,576.
+"""
+def checkpointed_sig_to_config_dictionary(checkpoint_dir, catalog_file="sig_to_config.bin",
+                                          rotor_permutations=None, processes=None, shards_per_order=26,
+                                          rings=False, model=None):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    if rotor_permutations is None:
+        rotor_permutations = gen_rotor_perms(model)
+    if rings:
+        shards = gen_ring_shards(rotor_permutations, shards_per_order)
+    else:
+        shards = gen_shards(rotor_permutations, gen_starting_positions(), shards_per_order)
+    todo = [shard for shard in shards if not os.path.exists(shard_filename(checkpoint_dir, shard))]
+    print("%d of %d shards already checkpointed" % (len(shards) - len(todo), len(shards)), file=sys.stderr)
+    start_time = time.time()
+    for done, shard_dict in enumerate(pool_imap(compute_sigs_for_shard, todo, processes), 1):
+        filename = shard_filename(checkpoint_dir, todo[done - 1])
+        write_catalog(shard_dict, filename + ".part")
+        os.replace(filename + ".part", filename)
+        print("shard %d/%d (%s) checkpointed after %.1fs" % (done, len(todo),
+              os.path.basename(filename), time.time() - start_time), file=sys.stderr)
+    merge_catalogs([shard_filename(checkpoint_dir, shard) for shard in shards], catalog_file + ".part")
+    os.replace(catalog_file + ".part", catalog_file)
+    return catalog_file
+
+# Instrumentation, off unless asked for.  Inside "with instrumented() as
+# stats:", the functions in INSTRUMENTED_STAGES are swapped for wrappers
+# that count their calls and time them, and are put back afterwards, so
+# the engines pay nothing when it is off.  Only this process is measured:
+# build catalogs with processes=1 to see the work the pool would do.
+
+# stage name: (object holding the function, function name)
+INSTRUMENTED_STAGES = {
+    "machine setup"           : ("enigma", "enigma"),
+    "Rotor.encode"            : ("Rotor", "encode"),
+    "gen_cycle_chains"        : ("enigma", "gen_cycle_chains"),
+    "combine_chains"          : ("enigma", "combine_chains"),
+    "merge_sort"              : ("enigma", "merge_sort"),
+    "compute_signature"       : ("enigma", "compute_signature"),
+    "keystroke_permutations"  : ("enigma", "keystroke_permutations"),
+    "cycle_lengths"           : ("enigma", "cycle_lengths"),
+    "catalog writing"         : ("enigma", "write_catalog"),
+    "catalog merging"         : ("enigma", "merge_catalogs"),
+    "text file writing"       : ("enigma", "write_to_sig_to_config_file"),
+}
+
+class StageStats:
+    def __init__(self):
+        self.calls, self.seconds, self.depth = {}, {}, {}
+        self.wall = 0.0
+
+    def wrap(self, stage, function):
+        '''Returns function wrapped to count its calls and time them
+           under stage.  A call made from inside another call of the
+           same stage (merge_sort recursing, say) is counted but not
+           timed again.'''
+        self.calls.setdefault(stage, 0)
+        self.seconds.setdefault(stage, 0.0)
+        self.depth.setdefault(stage, 0)
+        def wrapper(*args, **kwargs):
+            self.calls[stage] += 1
+            if self.depth[stage]:
+                return function(*args, **kwargs)
+            self.depth[stage] = 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+                self.depth[stage] = 0
+        return wrapper
+
+    def report(self):
+        '''Returns the per-stage breakdown as a table: calls, seconds
+           and share of the wall time for each stage that ran.  Stages
+           nest (encipherment runs Rotor.encode, signatures run
+           keystroke_permutations), so shares add up to more than 100%.'''
+        lines = ["%-24s %12s %10s %7s" % ("stage", "calls", "seconds", "wall")]
+        for stage in sorted(self.calls, key=lambda stage: -self.seconds[stage]):
+            if self.calls[stage]:
+                lines.append("%-24s %12d %10.3f %6.1f%%" % (stage, self.calls[stage], self.seconds[stage],
+                                                            100 * self.seconds[stage] / (self.wall or 1)))
+        lines.append("%-24s %12s %10.3f" % ("wall time", "", self.wall))
+        return "\n".join(lines)
+
+"""
+A context manager that instruments the stages in INSTRUMENTED_STAGES
+for the code run inside it, and yields the StageStats they fill in.
+The machines enigma() builds while it is on also time their
+encipherment, as the "encipher" stage.
+"""
+@contextmanager
+def instrumented():
+    stats, module = StageStats(), sys.modules[__name__]
+    originals = []
+    for stage, (owner, name) in INSTRUMENTED_STAGES.items():
+        owner = module if owner == "enigma" else getattr(module, owner)
+        originals.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, stats.wrap(stage, getattr(owner, name)))
+    build_machine = module.enigma
+    module.enigma = lambda *args, **kwargs: stats.wrap("encipher", build_machine(*args, **kwargs))
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall = time.perf_counter() - start
+        for owner, name, function in originals:
+            setattr(owner, name, function)
+
+"""
+Takes in a machine built by enigma() and an iterable of chunks of text,
+and yields each chunk enciphered: letters of either case come out as
+upper case letters, and everything else passes through as it is,
+without stepping the rotors.  The machine keeps its rotor positions
+from call to call, so however the text is split into chunks, it comes
+out as if enciphered in one piece.
+"""
+LETTER_RUNS = re.compile("[A-Za-z]+")
+def encipher_chunks(encipher, chunks):
+    for chunk in chunks:
+        runs = list(LETTER_RUNS.finditer(chunk))
+        enciphered = encipher("".join(run.group() for run in runs))
+        pieces, start, done = [], 0, 0
+        for run in runs:
+            pieces.append(chunk[start:run.start()])
+            pieces.append(enciphered[done:done + run.end() - run.start()])
+            done, start = done + run.end() - run.start(), run.end()
+        pieces.append(chunk[start:])
+        yield "".join(pieces)
+
+"""
+Takes in a list of file names ("-" for standard input) and a chunk size,
+and yields the files' contents one after the other, chunk_size bytes at
+a time.  Bytes are read as Latin-1, which maps each byte to one
+character and back, so text in any encoding (or none) passes through a
+machine byte for byte, and only ASCII letters are enciphered.
+"""
+def read_latin1_chunks(filenames, chunk_size):
+    for filename in filenames:
+        f = sys.stdin.buffer if filename == "-" else open(filename, "rb")
+        try:
+            chunk = f.read(chunk_size)
+            while chunk:
+                yield chunk.decode("latin-1")
+                chunk = f.read(chunk_size)
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+"""
+Takes in parsed command line arguments, and returns the configuration
+[slow, medi, fast, plugboard_pairs, ring_setting, initial_position,
+reflector] they give
+"""
+def args_config(args):
+    pairs = args.plugboard.upper().split()
+    if any(len(pair) != 2 or not pair.isalpha() for pair in pairs):
+        raise SystemExit("error: plugboard pairs are two letters each, as in AB CD")
+    plugboard_pairs = [(pair[0], pair[1]) for pair in pairs]
+    return [rotor.upper() for rotor in args.rotors] + [plugboard_pairs, args.rings.upper(), args.position.upper(),
+                                                       args.reflector]
+
+"""
+the encrypt and decrypt subcommands (the same thing, on an Enigma):
+streams the input through one machine chunk by chunk, so memory use
+does not grow with the input
+"""
+def encrypt_command(args):
+    encipher = enigma(*args_config(args))
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in encipher_chunks(encipher, read_latin1_chunks(args.files or ["-"], args.chunk_size)):
+            out.write(chunk.encode("latin-1"))
+    finally:
+        if out is sys.stdout.buffer:
+            out.flush()
+        else:
+            out.close()
+
+"""
+the signature subcommand: prints the signature of a configuration
+"""
+def signature_command(args):
+    print(compute_signature(*args_config(args)))
+
+"""
+the build-catalog subcommand: builds the signature catalog, either in
+memory, or shard by shard with checkpoints if given a directory for
+them, optionally with a per-stage breakdown of the time taken
+"""
+def build_catalog_command(args):
+    processes = 1 if args.stats else (args.processes or None)
+    def build():
+        if args.checkpoint_dir:
+            checkpointed_sig_to_config_dictionary(args.checkpoint_dir, args.output, processes=processes,
+                                                  rings=args.rings, model=args.model)
+        else:
+            write_catalog(parallel_sig_to_config_dictionary(processes), args.output)
+    if args.stats:
+        with instrumented() as stats:
+            build()
+        print(stats.report(), file=sys.stderr)
+    else:
+        build()
+
+"""
+the lookup subcommand: finds candidate day keys for batches of doubled
+indicators in a catalog, like lookup.py
+"""
+def lookup_command(args):
+    from lookup import answer_batches # lookup.py imports this module
+    answer_batches(args.catalog, args.indicators, args.limit)
+
 def main():
-    sig_to_config_dictionary()
+    parser = argparse.ArgumentParser(description="An Enigma machine, and the signature catalog attack on it.")
+    commands = parser.add_subparsers(dest="command")
+
+    machine = argparse.ArgumentParser(add_help=False)
+    machine.add_argument("--rotors", nargs=3, default=["I", "II", "III"], help="slow, middle and fast rotors")
+    machine.add_argument("--rings", default="AAA", help="ring setting")
+    machine.add_argument("--position", default="AAA", help="letters in the windows at the start")
+    machine.add_argument("--plugboard", default="", help='letter pairs to swap, as in "AB CD"')
+    machine.add_argument("--reflector", default="B", help="reflector spec, e.g. C or B-thin,beta,AQ")
+
+    for name in ("encrypt", "decrypt"):
+        command = commands.add_parser(name, parents=[machine],
+                                      help="%s files or stdin, streaming; non-letters pass through" % name)
+        command.add_argument("files", nargs="*", help="input files, one stream after another (default stdin)")
+        command.add_argument("-o", "--output", default="-", help="output file (default stdout)")
+        command.add_argument("--chunk-size", type=int, default=1 << 16, help="bytes to read at a time")
+        command.set_defaults(run=encrypt_command)
+
+    command = commands.add_parser("signature", parents=[machine], help="print a configuration's signature")
+    command.set_defaults(run=signature_command)
+
+    command = commands.add_parser("build-catalog", help="build the signature catalog")
+    command.add_argument("-o", "--output", default="sig_to_config.bin")
+    command.add_argument("--processes", type=int, default=0, help="worker processes (0 for one per core)")
+    command.add_argument("--checkpoint-dir", help="checkpoint shards here, resuming any already done")
+    command.add_argument("--rings", action="store_true", help="cover every ring setting (needs --checkpoint-dir)")
+    command.add_argument("--model", choices=sorted(MACHINES), help="catalog this model's rotor orders and reflectors "
+                                                                   "(needs --checkpoint-dir)")
+    command.add_argument("--stats", action="store_true",
+                         help="print a per-stage breakdown of where the time went (runs in one process)")
+    command.set_defaults(run=build_catalog_command)
+
+    command = commands.add_parser("lookup", help="find candidate day keys for doubled indicators")
+    command.add_argument("indicators", nargs="*",
+                         help="six letter indicators; if none are given, each line of stdin is one batch")
+    command.add_argument("--catalog", default="sig_to_config.bin")
+    command.add_argument("--limit", type=int, default=None, help="print at most this many candidates")
+    command.set_defaults(run=lookup_command)
+
+    # with no arguments at all, build the catalog, as this script always has
+    args = parser.parse_args(sys.argv[1:] or ["build-catalog"])
+    if args.command == "build-catalog" and (args.rings or args.model) and not args.checkpoint_dir:
+        parser.error("--rings and --model need --checkpoint-dir")
+    args.run(args)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,268 @@
+"""
+ioc_attack.py
+Authors: Robbie Young, Antonio Marino
+A ciphertext-only attack on Enigma: score every rotor order and start
+position by the index of coincidence of the decryption with an empty
+plugboard, then hill-climb plugboard pairs and ring settings on the
+best candidates, using n-gram statistics of a reference text as the
+fitness function
+"""
+
+import argparse
+import heapq
+import sys
+import time
+from collections import Counter
+from itertools import repeat
+from math import log
+from operator import add, mul
+from enigma import gen_rotor_perms, scrambler_table, stepping_table, stepping_sequence
+from enigma import encipher_codes, plugboard_table, order_reflector, config_fields, position_name
+from enigma import pool_imap, MACHINES, POSITIONS
+from substitution_ciphers import ALPHABET, load_file, count_Ngram_frequency, ltr2int, int2ltr
+from substitution_ciphers import reference_model, MODEL_N
+
+"""
+Takes in a string, and returns the letter indices of its letters,
+dropping everything else
+"""
+def letter_codes(text):
+    return [ord(ch) - 65 for ch in text.upper() if ch in ALPHABET]
+
+"""
+Takes in the names of the middle and fast rotors and a number of
+keystrokes n, and returns for every start position the table offsets
+(position * 26) of the rotors on keystrokes 1, ..., n.  The stepping
+splits the positions into loops (one of 16,900 steps for one-notch
+rotors, several shorter ones for two-notch rotors) and a few positions
+that take a keystroke or two to join one.  Starts on a loop share one
+list of that loop's offsets and get a slice of it; the rest are
+stepped out until they join one.
+"""
+def start_offsets(medi, fast, n):
+    next_position = stepping_table(medi, fast)
+    loop_index, loop_offsets = {}, []
+    for position in range(POSITIONS):
+        path, seen = [], set()
+        while position not in loop_index and position not in seen:
+            seen.add(position)
+            path.append(position)
+            position = next_position[position]
+        if position not in loop_index:
+            loop = path[path.index(position):]
+            for i, p in enumerate(loop):
+                loop_index[p] = (len(loop_offsets), i)
+            loop_offsets.append([p * 26 for p in loop * (n // len(loop) + 2)])
+    rows = []
+    for start in range(POSITIONS):
+        position, row = next_position[start], []
+        while position not in loop_index and len(row) < n:
+            row.append(position * 26)
+            position = next_position[position]
+        if len(row) < n:
+            loop, i = loop_index[position]
+            row += loop_offsets[loop][i:i + n - len(row)]
+        rows.append(row)
+    return rows
+
+"""
+Takes in a rotor order (optionally with a reflector spec after the
+rotors), a list of ciphertext letter indices and a number of positions
+to keep, and returns the (index of coincidence, position) pairs of the
+best start positions for that order, decrypting with an empty
+plugboard.  Every start's decryption is one gather through the order's
+scrambler table.
+"""
+def position_scores(rotor_perm, codes, keep):
+    slow, medi, fast = rotor_perm[:3]
+    scrambler = scrambler_table(slow, medi, fast, "AAA", order_reflector(rotor_perm))
+    pairs = len(codes) * (len(codes) - 1) or 1
+    best = []
+    for start, row in enumerate(start_offsets(medi, fast, len(codes))):
+        counts = Counter(map(scrambler.__getitem__, map(add, row, codes))).values()
+        ioc = sum(map(mul, counts, map(add, counts, repeat(-1)))) / pairs
+        if len(best) < keep:
+            heapq.heappush(best, (ioc, start))
+        elif ioc > best[0][0]:
+            heapq.heapreplace(best, (ioc, start))
+    return sorted(best, reverse=True)
+
+"""
+unpacks the arguments for position_scores, for use with pool_imap
+"""
+def position_scores_shard(args):
+    return args[0], position_scores(*args)
+
+"""
+Takes in a ciphertext, and returns the `keep` best (index of
+coincidence, config) pairs over every rotor order (or the given ones)
+of the problem set's machine or of a model from MACHINES, running the
+orders in a pool of processes if asked for more than one
+"""
+def ioc_sweep(ciphertext, keep=10, rotor_permutations=None, processes=1, model=None):
+    if rotor_permutations is None:
+        rotor_permutations = gen_rotor_perms(model)
+    codes = letter_codes(ciphertext)
+    jobs = [(rotor_perm, codes, keep) for rotor_perm in rotor_permutations]
+    best, start_time = [], time.time()
+    for done, (rotor_perm, scores) in enumerate(pool_imap(position_scores_shard, jobs, processes), 1):
+        best.extend((ioc, [rotor_perm[0], rotor_perm[1], rotor_perm[2], [], "AAA", position_name(start)]
+                     + rotor_perm[3:]) for ioc, start in scores)
+        print("order %d/%d (%s) done after %.1fs" % (done, len(jobs), "/".join(rotor_perm),
+              time.time() - start_time), file=sys.stderr)
+    return heapq.nlargest(keep, best, key=lambda pair: pair[0])
+
+"""
+Takes in a reference file and n, and returns a table of log
+probabilities for every n-gram, indexed by the n-gram's letter indices
+read as a base 26 number; n-grams never seen get a small floor.  Up to
+quadgrams, the table comes from the reference text's cached model.
+"""
+def ngram_log_table(reference_file, n):
+    if n <= MODEL_N:
+        return reference_model(reference_file).log_probs(n)
+    counts = count_Ngram_frequency(load_file(reference_file), n)
+    total = sum(counts.values())
+    floor = log(0.01 / total)
+    table = [floor] * 26 ** n
+    for ngram, count in counts.items():
+        if ngram.isascii():
+            code = 0
+            for ch in ngram:
+                code = code * 26 + ord(ch) - 65
+            table[code] = log(count / total)
+    return table
+
+"""
+Takes in a list of letter indices and an n-gram log probability table,
+and returns the text's total log probability
+"""
+def fitness(letters, table, n):
+    codes = letters[:len(letters) - n + 1]
+    for i in range(1, n):
+        codes = list(map(add, map(mul, codes, repeat(26)), letters[i:]))
+    return sum(map(table.__getitem__, codes))
+
+"""
+Takes in a config, a ciphertext and an n-gram table, and hill-climbs
+the plugboard: starting from the config's pairs, it keeps taking any
+single change (adding, removing or re-pairing one pair of letters)
+that improves the fitness of the decryption, using at most max_pairs
+cables, until no change helps.  Returns (fitness, config with the pairs found).
+"""
+def climb_plugboard(config, ciphertext, table, n, max_pairs=10):
+    slow, medi, fast, plugboard_pairs, ring_setting, position, reflector = config_fields(config)
+    codes = letter_codes(ciphertext)
+    scrambler = scrambler_table(slow, medi, fast, ring_setting, reflector)
+    row = keystroke_offsets(medi, fast, position, len(codes))
+
+    def decrypt(plugs):
+        return list(map(plugs.__getitem__, map(scrambler.__getitem__,
+                        map(add, row, map(plugs.__getitem__, codes)))))
+
+    plugs = list(plugboard_table(plugboard_pairs))
+    best = fitness(decrypt(plugs), table, n)
+    improved = True
+    while improved:
+        improved = False
+        for a in range(26):
+            for b in range(a + 1, 26):
+                trial = plugs[:]
+                if trial[a] == b:
+                    trial[a], trial[b] = a, b
+                else:
+                    trial[trial[a]], trial[trial[b]] = trial[a], trial[b]
+                    trial[a], trial[b] = b, a
+                    if sum(trial[i] != i for i in range(26)) > 2 * max_pairs:
+                        continue
+                score = fitness(decrypt(trial), table, n)
+                if score > best:
+                    best, plugs, improved = score, trial, True
+    pairs = [(ALPHABET[a], ALPHABET[plugs[a]]) for a in range(26) if plugs[a] > a]
+    return best, [slow, medi, fast, pairs, ring_setting, position] + config[6:]
+
+"""
+Takes in a config, a ciphertext and an n-gram table, and climbs the
+ring settings of the fast and middle rotors.  First it tries every fast
+ring setting, turning the window letter on with the ring so that the
+wiring starts where it was and only the turnover moves.  A turnover t
+keystrokes early looks much like the middle rotor sitting one letter
+further on, so the index of coincidence sweep often gets the two mixed
+up; each fast ring setting is tried with every middle window letter.
+Then it tries every middle ring setting, again with every middle window
+letter.  The slow rotor's ring never matters (see canonical_settings
+in enigma.py), so it stays.  Returns (fitness, config) for the best
+settings found.
+"""
+def climb_rings(config, ciphertext, table, n):
+    slow, medi, fast, plugboard_pairs, ring_setting, position = config[:6]
+    codes = letter_codes(ciphertext)
+    trials = [[ring_setting[:2] + int2ltr(ltr2int(ring_setting[2]) + turn),
+               position[0] + int2ltr(window) + int2ltr(ltr2int(position[2]) + turn)]
+              for turn in range(26) for window in range(26)]
+    score, (ring_setting, position) = max((fitness(encipher_codes(config[:4] + trial + config[6:], codes), table, n),
+                                           trial) for trial in trials)
+    trials = [[ring_setting[0] + int2ltr(medi_ring) + ring_setting[2], position[0] + int2ltr(window) + position[2]]
+              for medi_ring in range(26) for window in range(26)]
+    score, trial = max((fitness(encipher_codes(config[:4] + trial + config[6:], codes), table, n), trial)
+                       for trial in trials)
+    return score, config[:4] + trial + config[6:]
+
+"""
+Takes in the names of the middle and fast rotors, a start position and
+a number of keystrokes n, and returns the table offsets (position * 26)
+of the rotors on keystrokes 1, ..., n
+"""
+def keystroke_offsets(medi, fast, position, n):
+    sequence, loop_start = stepping_sequence(medi, fast, position)
+    positions = sequence[:n]
+    while len(positions) < n:
+        positions += sequence[loop_start:loop_start + n - len(positions)]
+    return [p * 26 for p in positions]
+
+"""
+Takes in a config, a ciphertext and an n-gram table, and climbs the
+plugboard, then the ring settings, then the plugboard again from the
+pairs found, since a better ring setting fixes the letters after a
+turnover and lets more pairs show.  Returns (fitness, config).
+"""
+def climb(config, ciphertext, table, n):
+    score, config = climb_plugboard(config, ciphertext, table, n)
+    score, config = climb_rings(config, ciphertext, table, n)
+    return climb_plugboard(config, ciphertext, table, n)
+
+"""
+Takes in a ciphertext and a reference file, runs the index of
+coincidence sweep, then climbs the plugboard (and, if asked, the ring
+settings) for each of the `keep` best candidates.  Returns (fitness,
+config) pairs, best first.
+"""
+def ioc_attack(ciphertext, reference_file, keep=10, n=2, rotor_permutations=None, processes=1, rings=True,
+               model=None):
+    table = ngram_log_table(reference_file, n)
+    candidates = ioc_sweep(ciphertext, keep, rotor_permutations, processes, model)
+    climber = climb if rings else climb_plugboard
+    results = [climber(config, ciphertext, table, n) for ioc, config in candidates]
+    return sorted(results, key=lambda pair: -pair[0])
+
+def main():
+    parser = argparse.ArgumentParser(description="Ciphertext-only attack on Enigma.")
+    parser.add_argument("ciphertext_file")
+    parser.add_argument("--reference", default="shakespeare.txt")
+    parser.add_argument("--keep", type=int, default=10, help="candidates to climb the plugboard on")
+    parser.add_argument("-n", type=int, default=2, help="n-gram length for the fitness function")
+    parser.add_argument("--rotors", nargs=3, help="only try this rotor order")
+    parser.add_argument("--reflector", help="reflector spec for --rotors, e.g. C or B-thin,beta,AQ")
+    parser.add_argument("--model", choices=sorted(MACHINES), help="try every rotor order and reflector of this model")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes (0 for one per core)")
+    parser.add_argument("--no-rings", action="store_true", help="keep ring setting AAA instead of climbing it")
+    args = parser.parse_args()
+    rotor_permutations = None
+    if args.rotors:
+        rotor_permutations = [args.rotors + ([args.reflector] if args.reflector else [])]
+    for score, config in ioc_attack(load_file(args.ciphertext_file), args.reference, args.keep, args.n,
+                                    rotor_permutations, args.processes or None, not args.no_rings, args.model):
+        print("%.1f:%s" % (score, config))
+
+if __name__ == "__main__":
+    main()
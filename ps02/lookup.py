@@ -0,0 +1,236 @@
+"""
+lookup.py
+Authors: Robbie Young, Antonio Marino
+From intercepted doubled indicators to candidate day keys, through
+the signature catalog
+"""
+
+import argparse
+import os
+import struct
+import sys
+from array import array
+from catalog import SignatureCatalog, POSITIONS, key_signature
+from enigma import stepping_table, cycle_lengths, keystroke_permutations, config_fields, class_numbers
+from substitution_ciphers import ltr2int
+
+TAGS_MAGIC = b"SIGTAG"
+# magic, version, catalog size and modification time, record count
+TAGS_HEADER = struct.Struct("<6sHQqQ")
+
+"""
+Takes in a list of enciphered doubled indicators (six letters each),
+and returns the three partial permutations they reveal, taking the
+first letter to the fourth, the second to the fifth and the third to
+the sixth, as lists of 26 with None for letters not seen yet
+"""
+def indicator_permutations(indicators):
+    perms = [[None] * 26 for i in range(3)]
+    for indicator in indicators:
+        if len(indicator) != 6 or not indicator.isalpha():
+            raise ValueError("indicator %r is not six letters" % indicator)
+        for i in range(3):
+            this_char, next_char = ltr2int(indicator[i]), ltr2int(indicator[i + 3])
+            if perms[i][this_char] not in (None, next_char):
+                raise ValueError("indicator %r contradicts an earlier one" % indicator)
+            perms[i][this_char] = next_char
+    return perms
+
+"""
+Takes in a partial permutation, and returns its signature,
+or None if some letters are still unknown
+"""
+def partial_signature(perm):
+    if None in perm:
+        return None
+    return cycle_lengths(perm)
+
+"""
+Takes in a configuration, and returns the signatures of the second and
+third letters of its doubled indicators, worked out from scratch
+"""
+def later_signatures(config):
+    fields = config_fields(config)
+    second, third, fifth, sixth = keystroke_permutations(*fields[:6], (2, 3, 5, 6), fields[6])
+    return cycle_lengths([fifth[c] for c in second]), cycle_lengths([sixth[c] for c in third])
+
+"""
+Takes in a rotor order and the record number of its position AAA, and
+returns the record numbers one keystroke on from each of its positions
+AAA, ..., ZZZ.  The second and third letters of an indicator are
+enciphered just as the first would be from one and two keystrokes on,
+so their signatures are the catalog signatures of those records.
+"""
+def next_positions(order, base):
+    return [base + position for position in stepping_table(order[1], order[2])]
+
+class IndicatorLookup:
+    '''Answers queries against a binary catalog that stays open across
+       queries.  On loading, the signature index goes into a dictionary
+       and every configuration is tagged with its signature's entry
+       number and the configuration one keystroke on, so that ranking
+       candidates costs a few array lookups.  For a catalog of a single
+       ring setting the tags are indexed by config id.  A ring catalog
+       lists only one configuration per class of equivalent ring
+       settings, and the configuration one keystroke on is often not the
+       one listed for its class, so there the tags are indexed by record
+       position, and point to the record listed for the class of the
+       configuration one keystroke on; working those out takes a while,
+       so they are saved to a .tags file next to the catalog.'''
+
+    def __init__(self, filename):
+        self.catalog = SignatureCatalog(filename)
+        self.index = {}
+        for i in range(len(self.catalog)):
+            self.index[key_signature(self.catalog[i][0])] = i
+        self.by_record = len(self.catalog.rings) > 1
+        if self.by_record:
+            if not self.load_tags(filename + ".tags", os.stat(filename)):
+                self.tag_ring_records()
+                self.save_tags(filename + ".tags", os.stat(filename))
+        else:
+            self.signature_ids = array("i", [-1]) * (len(self.catalog.orders) * POSITIONS)
+            for i in range(len(self.catalog)):
+                for config_id in self.catalog.entry_config_ids(i):
+                    self.signature_ids[config_id] = i
+            self.next_ids = array("i")
+            for order_id, order in enumerate(self.catalog.orders):
+                self.next_ids.extend(next_positions(order, order_id * POSITIONS))
+
+    def tag_ring_records(self):
+        '''Tags every record of a ring catalog with its signature's
+           entry number and the record listed for the class (see
+           enigma.class_numbers) of its configuration one keystroke on,
+           or -1 if the catalog lists none.  A configuration's later
+           signatures only depend on its first six keystrokes, which
+           every configuration of its class shares, so following these
+           tags finds them.'''
+        rings = [[ltr2int(ch) for ch in ring_setting] for ring_setting in self.catalog.rings]
+        # For each order and ring setting, the class number of every
+        # medium and fast position, the slow offsets and the stepping, so
+        # the class of a position is two lookups and an add.
+        tables, n_classes = [], 0
+        for order in self.catalog.orders:
+            fast_numbers, medi_numbers, count = class_numbers(order[1], order[2])
+            steps = stepping_table(order[1], order[2])
+            for slow_ring, medi_ring, fast_ring in rings:
+                rows = [medi_numbers[fast_numbers[(fast - fast_ring) % 26 * 26 + fast_ring]] for fast in range(26)]
+                medi_index = [(medi - medi_ring) % 26 * 26 + medi_ring for medi in range(26)]
+                low = [rows[fast][medi_index[medi]] * 26 for medi in range(26) for fast in range(26)]
+                slow = [n_classes + (slow - slow_ring) % 26 for slow in range(26)]
+                tables.append((low, slow, steps))
+            n_classes += 26 * count
+        n_records = self.catalog.n_records
+        records = array("i", [-1]) * n_classes
+        self.signature_ids = signature_ids = array("i", [-1]) * n_records
+        self.next_ids = next_ids = array("i", [-1]) * n_records
+        record = 0
+        for i in range(len(self.catalog)):
+            for config_id in self.catalog.entry_config_ids(i):
+                low, slow, steps = tables[config_id // POSITIONS]
+                position = config_id % POSITIONS
+                records[low[position % 676] + slow[position // 676]] = record
+                position = steps[position]
+                next_ids[record] = low[position % 676] + slow[position // 676]
+                signature_ids[record] = i
+                record += 1
+        # next_ids holds class numbers until every record is placed.
+        for record in range(n_records):
+            next_ids[record] = records[next_ids[record]]
+
+    def load_tags(self, filename, catalog_stat):
+        '''Reads the record tags saved by save_tags, and returns True, or
+           returns False if there are none saved for this catalog.'''
+        try:
+            with open(filename, "rb") as f:
+                magic, version, size, mtime, n_records = TAGS_HEADER.unpack(f.read(TAGS_HEADER.size))
+                if (magic, version, size, mtime, n_records) != (TAGS_MAGIC, 1, catalog_stat.st_size,
+                                                                catalog_stat.st_mtime_ns, self.catalog.n_records):
+                    return False
+                self.signature_ids, self.next_ids = array("i"), array("i")
+                self.signature_ids.fromfile(f, n_records)
+                self.next_ids.fromfile(f, n_records)
+        except (OSError, EOFError, struct.error):
+            return False
+        return True
+
+    def save_tags(self, filename, catalog_stat):
+        '''Saves the record tags next to the catalog, so the next lookup
+           on it reads them instead of working them out again.  They are
+           only reused while the catalog's size and modification time are
+           unchanged.  A catalog in a read-only directory just goes
+           without.'''
+        try:
+            with open(filename + ".part", "wb") as f:
+                f.write(TAGS_HEADER.pack(TAGS_MAGIC, 1, catalog_stat.st_size,
+                                         catalog_stat.st_mtime_ns, self.catalog.n_records))
+                self.signature_ids.tofile(f)
+                self.next_ids.tofile(f)
+            os.replace(filename + ".part", filename)
+        except OSError:
+            pass
+
+    def close(self):
+        self.catalog.close()
+
+    def query(self, indicators, limit=None):
+        '''Takes in a batch of indicators from one day, and returns
+           (score, config) pairs for the candidate day keys, best first.
+           Every candidate matches the first-to-fourth signature; the
+           score counts how many of the second-to-fifth and
+           third-to-sixth signatures also match; ties keep catalog order.'''
+        signatures = [partial_signature(perm) for perm in indicator_permutations(indicators)]
+        if signatures[0] is None:
+            raise ValueError("indicators do not yet cover all 26 letters in the first position")
+        if signatures[0] not in self.index:
+            return []
+        by_score = [[], [], []]
+        i = self.index[signatures[0]]
+        second, third = [self.index.get(signature, -2) for signature in signatures[1:]]
+        signature_ids, next_ids = self.signature_ids, self.next_ids
+        config_ids = self.catalog.entry_config_ids(i)
+        tags = range(self.catalog[i][1], self.catalog[i][1] + len(config_ids)) if self.by_record else config_ids
+        for config_id, tag in zip(config_ids, tags):
+            next_id = next_ids[tag]
+            if next_id < 0 or next_ids[next_id] < 0:
+                found = later_signatures(self.catalog.config(config_id))
+                by_score[(found[0] == signatures[1]) + (found[1] == signatures[2])].append(config_id)
+            else:
+                by_score[(signature_ids[next_id] == second) + (signature_ids[next_ids[next_id]] == third)].append(config_id)
+        ranked = [(score, config_id) for score in (2, 1, 0) for config_id in by_score[score]]
+        return [(score, self.catalog.config(config_id)) for score, config_id in ranked[:limit]]
+
+"""
+Takes in a catalog file name, a batch of indicators (if none, each line
+of stdin is read as one batch) and a limit, and prints the candidate day
+keys for each batch, followed by a blank line, keeping the catalog open
+across batches.  A batch the lookup rejects gets an error on stderr.
+"""
+def answer_batches(catalog_file, indicators, limit=None):
+    lookup = IndicatorLookup(catalog_file)
+    try:
+        batches = [indicators] if indicators else (line.split() for line in sys.stdin)
+        for batch in batches:
+            if not batch:
+                continue
+            try:
+                for score, config in lookup.query(batch, limit):
+                    print("%d:%s" % (score, config))
+            except ValueError as e:
+                print("error: %s" % e, file=sys.stderr)
+            print()
+            sys.stdout.flush()
+    finally:
+        lookup.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Find candidate day keys for a batch of doubled indicators.")
+    parser.add_argument("indicators", nargs="*",
+                        help="six letter indicators; if none are given, each line of stdin is one batch")
+    parser.add_argument("--catalog", default="sig_to_config.bin")
+    parser.add_argument("--limit", type=int, default=None, help="print at most this many candidates")
+    args = parser.parse_args()
+    answer_batches(args.catalog, args.indicators, args.limit)
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,90 @@
 """
-Scripts to calculate averages of number of configurations to signatures
+Scripts to calculate statistics of number of configurations to signatures,
+in one pass over the catalog and without holding it in memory
 """
 
+import argparse
+import heapq
+from collections import Counter
+from math import log2
+from catalog import SignatureCatalog, MAGIC
 
-global_dict = {}
-global_list = []
+"""
+Takes in a catalog file, binary or text, and yields (signature, number
+of configurations) for each signature, one at a time
+"""
+def bucket_sizes(file):
+    with open(file, 'rb') as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        with SignatureCatalog(file) as catalog:
+            yield from catalog.signatures()
+    else:
+        with open(file, 'r') as f:
+            for line in f:
+                signature, configs = line.split(':', 1)
+                yield signature, configs.count('], [') + 1
 
-def scripts(file):
-    length = 0
-    with open(file, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.split(':')
-            line[1] = line[1].split('], [')
-            global_dict[line[0]] = len(line[1])
-            length += len(line[1])
-            
-    
-    total = len(global_dict.keys())
-    while len(global_dict.keys()) != 0:
-        largest = 0
-        largest_key = ''
-        for key in global_dict.keys():
-            if global_dict[key] > largest:
-                largest = global_dict[key]
-                largest_key = key
-        global_list.append(str(largest) + ':' + largest_key)
-        del global_dict[largest_key]
+"""
+Takes in a histogram of bucket sizes and a fraction p, and returns the
+bucket size below which a fraction p of the signatures fall
+"""
+def percentile(histogram, total, p):
+    seen = 0
+    for size in sorted(histogram):
+        seen += histogram[size]
+        if seen >= p * total:
+            return size
+    return 0
+
+"""
+Takes in a catalog file, and returns the histogram of bucket sizes,
+the k largest buckets, and summary statistics, all gathered in one pass
+"""
+def catalog_statistics(file, k=10):
+    histogram, top, length, weighted_log = Counter(), [], 0, 0.0
+    for signature, size in bucket_sizes(file):
+        histogram[size] += 1
+        length += size
+        weighted_log += size * log2(size)
+        if len(top) < k:
+            heapq.heappush(top, (size, str(signature)))
+        elif size > top[0][0]:
+            heapq.heapreplace(top, (size, str(signature)))
+    total = sum(histogram.values())
+    return {
+        'histogram': histogram,
+        'top': sorted(top, reverse=True),
+        'signatures': total,
+        'configurations': length,
+        'average': length / total if total else 0,
+        'median': percentile(histogram, total, 0.5),
+        'percentiles': {p: percentile(histogram, total, p / 100) for p in (10, 25, 75, 90, 99)},
+        # entropy (in bits) of the signature of a uniformly random configuration
+        'entropy': log2(length) - weighted_log / length if length else 0,
+    }
 
-    for ele in global_list:
-        print(ele)
-    print("average : ", length/total)
-    print(length)
+def scripts(file, k=10):
+    stats = catalog_statistics(file, k)
+    for size, signature in stats['top']:
+        print(str(size) + ':' + signature)
+    print("signatures : ", stats['signatures'])
+    print("configurations : ", stats['configurations'])
+    print("average : ", stats['average'])
+    print("median : ", stats['median'])
+    for p, size in stats['percentiles'].items():
+        print("%dth percentile : " % p, size)
+    print("entropy (bits) : ", stats['entropy'])
+    print("histogram (configurations per signature : signatures) :")
+    for size in sorted(stats['histogram']):
+        print("   ", size, ":", stats['histogram'][size])
 
 def main():
-    file = 'sig_to_config.txt'
-    scripts(file)
+    parser = argparse.ArgumentParser(description="Statistics of a signature to configuration catalog.")
+    parser.add_argument("file", nargs="?", default="sig_to_config.txt")
+    parser.add_argument("-k", "--top", type=int, default=10, help="how many of the largest buckets to list")
+    args = parser.parse_args()
+    scripts(args.file, args.top)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,8 +4,20 @@
 # CS 341 Cryptography, Carleton College
 # David Liben-Nowell (dln@carleton.edu)
 
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
+from itertools import repeat
+from math import log
+import argparse
+import hashlib
+import heapq
+import mmap
+import os
 import random
+import re
+import struct
+import sys
+import tempfile
 
 
 # ----- UTILITY FUNCTIONS ---------------------------------------------------- #
@@ -28,11 +40,27 @@ def load_file(filename):
         s = "".join(line for line in f)
     return s
 
+def read_chunks(filename, chunk_size=1 << 16):
+    '''Yield the text of the given file ("-" for standard input) a chunk
+       of at most chunk_size characters at a time, for the streaming
+       ciphers below.'''
+    f = sys.stdin if filename == "-" else open(filename, "r")
+    try:
+        chunk = f.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = f.read(chunk_size)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
 def count_Ngram_frequency(text, n=1):
     '''Count all sequences of N consecutive letters in the given string,
        and return a (default) dictionary of those counts.  Does NOT
        maintain case; all counts are for the input string converted to
        all upper case.  (So n=1 is unigrams, n=2 is bigrams, etc.)'''
+    if text.isascii() and n >= 1:
+        return defaultdict(int, count_Ngram_matches(text.upper(), n))
     counts = defaultdict(int)
     for i in range(len(text) - n + 1):
         ngram = text[i:i+n].upper()
@@ -40,6 +68,178 @@ def count_Ngram_frequency(text, n=1):
             counts[ngram.upper()] += 1
     return counts
 
+def Ngram_pattern(n):
+    '''A regular expression whose matches in an upper case string are its
+       n-grams of letters, overlapping ones included (for n >= 2).'''
+    return re.compile("(?=([A-Z]{%d}))" % n)
+
+def count_Ngram_matches(upper_text, n):
+    '''Count the n-grams of letters in an upper case ASCII string: the
+       regular expression engine picks out every window that is all
+       letters, and a Counter counts them, both without a Python-level
+       loop over the text (for single letters, str.count does).  Counts
+       are in order of first appearance, as with count_Ngram_frequency.'''
+    if n == 1:
+        present = sorted((ch for ch in ALPHABET if ch in upper_text), key=upper_text.find)
+        return Counter({ch: upper_text.count(ch) for ch in present})
+    return Counter(Ngram_pattern(n).findall(upper_text))
+
+def count_Ngram_frequencies(text, k):
+    '''Count the 1-grams through k-grams of the given string at once, and
+       return a list of k (default) dictionaries, the same as
+       count_Ngram_frequency(text, n) for n = 1, ..., k.  The text is
+       upper-cased once for all of them.'''
+    if not text.isascii():
+        return [count_Ngram_frequency(text, n) for n in range(1, k + 1)]
+    upper_text = text.upper()
+    return [defaultdict(int, count_Ngram_matches(upper_text, n)) for n in range(1, k + 1)]
+
+# Letter -> base 26 digit, as int() reads them.
+BASE26_DIGITS = str.maketrans(ALPHABET, "0123456789abcdefghijklmnop")
+
+def count_Ngram_arrays(text, k):
+    '''Count the 1-grams through k-grams of the given string at once, and
+       return them as a list of k dense arrays: entry code of the n-th is
+       the count of the n-gram whose letter indices, read as a base 26
+       number, make code (so AA...A is 0 and ZZ...Z is 26**n - 1).  Only
+       ASCII letters count as letters.'''
+    upper_text = text.encode("ascii", "replace").decode("ascii").upper()
+    arrays = []
+    for n in range(1, k + 1):
+        dense = array("q", bytes(8 * 26 ** n))
+        for ngram, count in count_Ngram_matches(upper_text, n).items():
+            dense[int(ngram.translate(BASE26_DIGITS), 26)] = count
+        arrays.append(dense)
+    return arrays
+
+def shift_table(shift):
+    '''Build the str.translate table that shifts each letter forward by
+       shift, wrapping around and keeping its case, and leaves every
+       other character alone.'''
+    shifted = "".join(int2ltr(i + shift) for i in range(26))
+    return str.maketrans(ALPHABET + alphabet, shifted + shifted.lower())
+
+
+# ----- REFERENCE MODELS ----------------------------------------------------- #
+#
+# The breakers all score candidate plaintexts against n-gram statistics of a
+# reference text (shakespeare.txt).  reference_model() counts the reference
+# text's 1-grams through 4-grams once and saves the counts and log
+# probabilities to a cache file keyed by the SHA-256 of the reference text;
+# later runs memory-map that file instead of counting again, and all the
+# breakers in one process share the same loaded model.  A cache file holds
+#
+#   header     magic, largest n, SHA-256 of the reference text
+#   totals     the number of n-grams counted, for each n, as i64
+#   counts     for each n, 26^n i64 counts, indexed by the n-gram's code
+#              (its letter indices read as a base 26 number)
+#   log probs  for each n, 26^n f64 log probabilities, log(count / total),
+#              or log(0.01 / total) for n-grams never seen
+#
+# all in the machine's byte order, as a cache is only read where it was written.
+
+MODEL_MAGIC = b"NGRAMS01"
+MODEL_HEADER = struct.Struct("<8sB7x32s")
+MODEL_N = 4
+REFERENCE_MODELS = {}   # SHA-256 of a reference text -> its loaded model
+
+class NgramModel:
+    '''The n-gram statistics of a reference text, read from a memory-mapped
+       cache file.  counts(n) and log_probs(n) are memoryviews indexed by
+       n-gram code, so they work as lookup tables as they are.'''
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_n, self.digest = MODEL_HEADER.unpack_from(self.data, 0)
+        if magic != MODEL_MAGIC:
+            raise ValueError("%s is not an n-gram model cache" % filename)
+        view, start = memoryview(self.data), MODEL_HEADER.size
+        self.totals = view[start:start + 8 * self.max_n].cast("q")
+        start += 8 * self.max_n
+        self.count_tables = []
+        for n in range(1, self.max_n + 1):
+            self.count_tables.append(view[start:start + 8 * 26 ** n].cast("q"))
+            start += 8 * 26 ** n
+        self.log_prob_tables = []
+        for n in range(1, self.max_n + 1):
+            self.log_prob_tables.append(view[start:start + 8 * 26 ** n].cast("d"))
+            start += 8 * 26 ** n
+
+    def counts(self, n):
+        '''Returns the n-gram counts, indexed by n-gram code.'''
+        return self.count_tables[n - 1]
+
+    def log_probs(self, n):
+        '''Returns the n-gram log probabilities, indexed by n-gram code.'''
+        return self.log_prob_tables[n - 1]
+
+    def total(self, n):
+        '''Returns how many n-grams the reference text has.'''
+        return self.totals[n - 1]
+
+    def letter_counts(self):
+        '''Returns a dictionary of the (upper case) letters' counts.'''
+        return {ch: self.count_tables[0][i] for i, ch in enumerate(ALPHABET)}
+
+    def letter_frequencies(self):
+        '''Returns a dictionary of the (lower case) letters' relative
+           frequencies.'''
+        letters = sum(self.count_tables[0])
+        return {ch: self.count_tables[0][i] / letters for i, ch in enumerate(alphabet)}
+
+def write_model(text, digest, filename, max_n=MODEL_N):
+    '''Count the 1-grams through max_n-grams of the given text and write
+       them to an n-gram model cache file (see above).  The totals count
+       every n-gram count_Ngram_frequency would, so the log probabilities
+       are the same as ones worked out from its counts.'''
+    totals, count_tables, log_prob_tables = array("q"), [], []
+    for n, frequency in enumerate(count_Ngram_frequencies(text, max_n), 1):
+        total = sum(frequency.values())
+        counts, log_probs = array("q", bytes(8 * 26 ** n)), array("d", [log(0.01 / (total or 1))]) * 26 ** n
+        for ngram, count in frequency.items():
+            if ngram.isascii() and len(ngram) == n:
+                code = int(ngram.translate(BASE26_DIGITS), 26)
+                counts[code], log_probs[code] = count, log(count / total)
+        totals.append(total)
+        count_tables.append(counts)
+        log_prob_tables.append(log_probs)
+    # Each writer gets its own temporary file, so breakers building the
+    # same cache at once never write into each other's; the last rename wins.
+    handle, part = tempfile.mkstemp(prefix=os.path.basename(filename) + ".",
+                                    suffix=".part", dir=os.path.dirname(filename) or ".")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(MODEL_HEADER.pack(MODEL_MAGIC, max_n, digest))
+            for table in [totals] + count_tables + log_prob_tables:
+                f.write(table.tobytes())
+        os.replace(part, filename)
+    except BaseException:
+        os.remove(part)
+        raise
+
+def reference_model(reference_file, cache_dir=None):
+    '''Load the n-gram model of the given reference text: from memory if
+       this process has loaded it already, or else from its cache file in
+       cache_dir (by default, the reference file's directory), building
+       the cache file first if there is none for this text.'''
+    with open(reference_file, "rb") as f:
+        digest = hashlib.sha256(f.read()).digest()
+    if digest not in REFERENCE_MODELS:
+        if cache_dir is None:
+            cache_dir = os.path.dirname(reference_file) or "."
+        filename = os.path.join(cache_dir, ".ngrams-%s.bin" % digest.hex()[:16])
+        model = None
+        if os.path.exists(filename):
+            model = NgramModel(filename)
+            if model.digest != digest or model.max_n < MODEL_N:
+                model = None
+        if model is None:
+            write_model(load_file(reference_file), digest, filename)
+            model = NgramModel(filename)
+        REFERENCE_MODELS[digest] = model
+    return REFERENCE_MODELS[digest]
+
 
 # ----- SUBSTITUTION CIPHERS-------------------------------------------------- #
 #
@@ -63,16 +263,10 @@ def caesar(shift):
        around as necessary.  E.g., with a shift of 2, we have A -> C,
        B -> D, ..., X -> Z, Y -> A.  This version maintains plaintext's case.'''
 
+    table = shift_table(shift)
+
     def encipher(plaintext):
-        ciphertext = ""
-        for ch in plaintext:
-            if ch in ALPHABET:
-                ciphertext += int2ltr(ltr2int(ch) + shift)
-            elif ch in alphabet:
-                ciphertext += int2ltr(ltr2int(ch) + shift).lower()
-            else:
-                ciphertext += ch
-        return ciphertext
+        return plaintext.translate(table)
     return encipher
 
 
@@ -100,16 +294,10 @@ def substitution_cipher(starter_key):
         key = "".join(key[i] for i in range(len(key))    
                       if key[i] not in starter_key[:i])  # (removes duplicates.)
 
+    table = str.maketrans(ALPHABET + alphabet, key[:26] + key[:26].lower())
+
     def encipher(plaintext):
-        ciphertext = ""
-        for ch in plaintext:
-            if ch in ALPHABET:
-                ciphertext += key[ltr2int(ch)]
-            elif ch in alphabet:
-                ciphertext += key[ltr2int(ch)].lower()
-            else:
-                ciphertext += ch
-        return ciphertext
+        return plaintext.translate(table)
     return encipher
 
 
@@ -127,20 +315,18 @@ def vigenere(key):
 
        This encryption maintains plaintext's case.'''
     
+    # One Caesar table per letter of the key; the letters at each phase
+    # of the key are a strided slice of the plaintext, translated at once.
+    tables = [shift_table(ltr2int(k)) for k in key]
+
     def encipher(plaintext):
-        ciphertext = ""
-        for i in range(len(plaintext)):
-            shift = ltr2int(key[i % len(key)])
-            if plaintext[i] in ALPHABET:
-                ciphertext += int2ltr(ltr2int(plaintext[i]) + shift)
-            elif plaintext[i] in alphabet:
-                ciphertext += int2ltr(ltr2int(plaintext[i]) + shift).lower()
-            else:
-                ciphertext += plaintext[i]
-        return ciphertext
+        ciphertext = list(plaintext)
+        for phase, table in enumerate(tables):
+            ciphertext[phase::len(tables)] = plaintext[phase::len(tables)].translate(table)
+        return "".join(ciphertext)
     return encipher
 
-def homophonic_substitution(reference_file, alphabet_size):
+def homophonic_substitution(reference_file, alphabet_size, seed=None):
     '''Homophonic Substitution Cipher: a (randomized) substitution cipher,
        built to ensure nearly equal frequencies of all symbols in the
        ciphertext (for a plaintext distributed as normal English).
@@ -152,14 +338,24 @@ def homophonic_substitution(reference_file, alphabet_size):
        is replaced by one of its corresponding symbols, chosen at
        random.  Symbols are allocated based on the "Method of Equal Proportions"
        [https://www.census.gov/population/apportionment/about/computing.html].
+       The randomness comes from the random module, or if given a seed,
+       from a random.Random(seed) of the cipher's own, so that the same
+       seed always gives the same key and the same ciphertexts.
+
+       The encipher function returns a list of symbols (as strings), or
+       with compact=True, an array of them (as integers), with
+       HOMOPHONIC_NEWLINE for each newline; homophonic_text() writes
+       either out as text.
 
        Note: this encryption does NOT maintain case, and everything
        nonalphabetical is stripped out, except newlines.'''
 
+    rng = random if seed is None else random.Random(seed)
+
     # Count frequencies in the reference text, and create randomly
     # ordered set of symbols {0, 1, ..., alphabet_size - 1}.
-    freq = count_Ngram_frequency(load_file(reference_file))
-    unused_symbols = random.sample(range(alphabet_size), alphabet_size)
+    freq = reference_model(reference_file).letter_counts()
+    unused_symbols = rng.sample(range(alphabet_size), alphabet_size)
     # print(unused_symbols)
     symbols = {}
 
@@ -170,24 +366,129 @@ def homophonic_substitution(reference_file, alphabet_size):
     # ... and then each remaining symbol is allocated to the letter i with the
     # largest "need", where need is defined as f[i] / sqrt(n[i] * (n[i] + 1))
     # where f[i] = frequency and n[i] = current number of symbols for letter i.
+    # The letters wait in a heap by need; only the letter just given a symbol
+    # changes its need, and ties go to the earlier letter in the alphabet.
     need = lambda ch: freq[ch]/(len(symbols[ch]) * (1 + len(symbols[ch])))**0.5
+    neediest_first = [(-need(ch), i) for i, ch in enumerate(ALPHABET)]
+    heapq.heapify(neediest_first)
     while len(unused_symbols) > 0:
-        neediest = max(ALPHABET, key=need)
+        neediest = ALPHABET[neediest_first[0][1]]
         symbols[neediest].append(unused_symbols.pop())
-
-    def encipher(plaintext):
-        ciphertext = []
-        for ch in plaintext.upper():
-            if ch in ALPHABET:
-                ciphertext.append(str(random.choice(symbols[ch])))
-            elif ch == "\n":
-                ciphertext.append(ch)
-        return ciphertext
+        heapq.heapreplace(neediest_first, (-need(neediest), neediest_first[0][1]))
+
+    def encipher(plaintext, compact=False):
+        # Draw every letter's symbols in one batch, then hand them out in
+        # order: map() pulls the next draw for each character in turn.
+        letters = plaintext.upper().encode("ascii", "ignore").translate(None, NOT_HOMOPHONIC)
+        draws = [None] * 256     # byte -> iterator over its symbols
+        draws[ord("\n")] = repeat(HOMOPHONIC_NEWLINE)
+        for ch in ALPHABET:
+            if len(symbols[ch]) == 1:
+                draws[ord(ch)] = repeat(symbols[ch][0])
+            elif len(symbols[ch]) <= 256:
+                draws[ord(ch)] = map(symbols[ch].__getitem__,
+                                     random_indices(rng, len(symbols[ch]), letters.count(ord(ch))))
+            else:
+                draws[ord(ch)] = iter(rng.choices(symbols[ch], k=letters.count(ord(ch))))
+        ciphertext = array("i", map(next, map(draws.__getitem__, letters)))
+        if compact:
+            return ciphertext
+        return list(map(symbol_strings.__getitem__, ciphertext))
+    symbol_strings = [str(symbol) for symbol in range(alphabet_size)] + ["\n"]  # [-1] is the newline
     return encipher
 
+def random_indices(rng, m, k):
+    '''Draw k independent uniform random numbers from {0, ..., m - 1}, for
+       m <= 256, as bytes: random bytes, less the top few that would make
+       some numbers likelier than others, taken modulo m, all in bulk.'''
+    modulo = bytes(b % m for b in range(256))
+    biased = bytes(range(256 // m * m, 256))
+    indices = b""
+    while len(indices) < k:
+        indices += rng.randbytes(k - len(indices) + 16).translate(modulo, biased)
+    return indices[:k]
+
+HOMOPHONIC_NEWLINE = -1
+NOT_HOMOPHONIC = bytes(b for b in range(256) if chr(b) not in ALPHABET + "\n")  # dropped bytes
+
+def homophonic_text(ciphertext):
+    '''Write a homophonic ciphertext, as either kind of output of
+       homophonic_substitution's encipher function, as text: the symbols
+       separated by spaces, each newline a symbol of its own, as in
+       " ".join(encipher(plaintext)).  This is the form ps01/Q2 reads.'''
+    if isinstance(ciphertext, array):
+        words = [str(symbol) for symbol in range(max(ciphertext, default=0) + 1)] + ["\n"]
+        return " ".join(map(words.__getitem__, ciphertext))
+    return " ".join(ciphertext)
+
+def homophonic_text_stream(ciphertexts):
+    '''Write homophonic ciphertext chunks as text chunk by chunk, the
+       same as homophonic_text of them all at once: a space goes between
+       one non-empty chunk and the next.'''
+    separator = ""
+    for ciphertext in ciphertexts:
+        if len(ciphertext):
+            yield separator + homophonic_text(ciphertext)
+            separator = " "
+
+
+# ----- STREAMING CIPHERS ---------------------------------------------------- #
+#
+# Streaming versions of the ciphers above, curried the same way, but the
+# function they return takes an iterable of chunks of plaintext (a list of
+# strings, an open file's lines, read_chunks(filename), ...) and yields the
+# ciphertext chunk by chunk, so a text of any size goes through in constant
+# memory.  Chunks may split the text anywhere; the output is the same as
+# enciphering the whole text at once.
 
+def stream(encipher):
+    '''Turn an encipher function into a streaming one that enciphers each
+       chunk on its own.  Only right for ciphers that treat every
+       character the same wherever it falls, i.e., not Vigenere.'''
 
-def main():
+    def encipher_chunks(chunks):
+        for chunk in chunks:
+            yield encipher(chunk)
+    return encipher_chunks
+
+
+def caesar_stream(shift):
+    '''Streaming Caesar Cipher.'''
+    return stream(caesar(shift))
+
+
+def substitution_cipher_stream(starter_key):
+    '''Streaming Substitution Cipher (random key if starter_key is None).'''
+    return stream(substitution_cipher(starter_key))
+
+
+def vigenere_stream(key):
+    '''Streaming Vigenere Cipher.  The key's phase carries over from one
+       chunk to the next: a chunk that starts i characters into the text
+       is enciphered with the key rotated by i % len(key).'''
+
+    rotated = {}    # phase -> vigenere cipher with the key rotated to it
+
+    def encipher_chunks(chunks):
+        phase = 0
+        for chunk in chunks:
+            if phase not in rotated:
+                rotated[phase] = vigenere(key[phase:] + key[:phase])
+            yield rotated[phase](chunk)
+            phase = (phase + len(chunk)) % len(key)
+    return encipher_chunks
+
+
+def homophonic_substitution_stream(reference_file, alphabet_size, seed=None, compact=False):
+    '''Streaming Homophonic Substitution Cipher: yields, for each chunk,
+       the symbols (and newlines) homophonic_substitution gives, as a
+       list, or with compact=True, an array.'''
+    encipher = homophonic_substitution(reference_file, alphabet_size, seed)
+    return stream(lambda chunk: encipher(chunk, compact))
+
+
+def demo():
+    '''Print a few sample encipherments.'''
     print("Here are a few sample encipherments.")
     print()
     print(caesar(random.randint(0,25))("Welcome to Cambridge."))
@@ -204,5 +505,41 @@ def main():
     for ch in ALPHABET:
         print("   ", ch, [x for x in range(100) if str(x) in encipherer(ch * 1000)])
 
+def main():
+    parser = argparse.ArgumentParser(description="Encipher text with a classical cipher, streaming it "
+                                                 "chunk by chunk; with no cipher, show a few samples.")
+    ciphers = parser.add_subparsers(dest="cipher")
+    command = ciphers.add_parser("caesar")
+    command.add_argument("shift", type=int)
+    command = ciphers.add_parser("substitution")
+    command.add_argument("key", nargs="?", help="starter key (a random key if none)")
+    command = ciphers.add_parser("vigenere")
+    command.add_argument("key")
+    command = ciphers.add_parser("homophonic", help="symbols and newlines are written separated "
+                                                    "by spaces, as in ps01/Q2/cipher.txt")
+    command.add_argument("reference_file")
+    command.add_argument("alphabet_size", type=int)
+    command.add_argument("--seed", type=int, help="seed for the key and the choice of symbols")
+    for command in ciphers.choices.values():
+        command.add_argument("--file", default="-", help="plaintext file (default stdin)")
+        command.add_argument("--chunk-size", type=int, default=1 << 16)
+    args = parser.parse_args()
+    if args.cipher is None:
+        demo()
+        return
+
+    chunks = read_chunks(args.file, args.chunk_size)
+    if args.cipher == "caesar":
+        output = caesar_stream(args.shift)(chunks)
+    elif args.cipher == "substitution":
+        output = substitution_cipher_stream(args.key.upper() if args.key else None)(chunks)
+    elif args.cipher == "vigenere":
+        output = vigenere_stream(args.key)(chunks)
+    else:
+        output = homophonic_text_stream(homophonic_substitution_stream(args.reference_file, args.alphabet_size,
+                                                                       args.seed, compact=True)(chunks))
+    for chunk in output:
+        sys.stdout.write(chunk)
+
 if __name__ == "__main__":
     main()
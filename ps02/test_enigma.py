@@ -3,7 +3,9 @@
 #    for CS 341 Cryptography, Carleton College.
 # David Liben-Nowell (dln@carleton.edu)
 
-from enigma import enigma
+from enigma import enigma, period_table, table_enigma
+from enigma import compute_signature, compute_signature_from_chains
+from enigma import EnigmaStream
 
 print("One character transformation sequence, I/II/III AAZ on 'G':")
 print("      [https://www.codesandciphers.org.uk/enigma/]")
@@ -44,6 +46,27 @@ result = enigma("III","II","I", [], "AAA", "ADO")("ABCDEF", debug=True)
 print("  correct:   ADO ADP ADQ AER BFS BFT BFU")
 print("  computed: ", result[1], "\n")
 
+print("Signature from keystroke permutations against chains, II/V/III QJX:")
+print("  correct:  ", compute_signature_from_chains("II", "V", "III", [], "AAA", "QJX"))
+print("  computed: ", compute_signature("II", "V", "III", [], "AAA", "QJX"), "\n")
+
+print("Ring setting, I/II/III rings BBB at AAA on 'AAAAA':")
+print("      [https://en.wikipedia.org/wiki/Enigma_rotor_details]")
+print("  correct:   EWTYX")
+print("  computed: ", enigma("I","II","III", [], "BBB", "AAA")("AAAAA"))
+print("  traced:   ", enigma("I","II","III", [], "BBB", "AAA", compiled=False)("AAAAA"), "\n")
+
+print("M4 with thin reflector B and beta at A against reflector B, VI/VII/VIII QMY:")
+message = "ADMIRALGRACEMURRAYHOPPER" * 10
+print("  correct:  ", enigma("VI","VII","VIII", [], "AAA", "QMY", "B")(message)[-24:])
+print("  computed: ", enigma("VI","VII","VIII", [], "AAA", "QMY", "B-thin,beta,AA")(message)[-24:], "\n")
+
+print("Stream seeked past the double step against the whole message, III/II/I ADO on 'ABCDEF':")
+stream = EnigmaStream("III", "II", "I", [], "AAA", "ADO")
+stream.seek(3)
+print("  correct:  ", enigma("III", "II", "I", [], "AAA", "ADO")("ABCDEF")[3:], "BFU")
+print("  computed: ", stream.feed("DEF"), stream.state()["position"], "\n")
+
 # Here are a few of the above tests, with the addition of the plugboard.
 # Uncomment these to test your plugboard implementation.
 
@@ -62,3 +85,119 @@ print("      [http://web.archive.org/web/*/www.intelligenia.org/downloads/rotors
 result = enigma("III","II","I", [("A","B"),("Y", "Z"),("C","D")], "AAA", "ADO")("ABCDEF", debug=True)
 print("  correct:   ADO ADP ADQ AER BFS BFT BFU")
 print("  computed: ", result[1], "\n")
+
+print("Compiled engine against the traced engine, II/I/IV DLN:")
+message = "ADMIRALGRACEMURRAYHOPPER" * 10
+result = enigma("II", "I", "IV", [], "AAA", "DLN")(message)
+traced = enigma("II", "I", "IV", [], "AAA", "DLN", compiled=False)(message)
+print("  correct:   True")
+print("  computed: ", result == traced, "\n")
+
+print("Period table against the compiled engine, III/II/I ADO, two messages:")
+encipher = table_enigma(*period_table("III", "II", "I", [], "AAA", "ADO"))
+first, second = "ADMIRALGRACEMURRAYHOPPER", "ABCDEF"
+print("  correct:  ", enigma("III", "II", "I", [], "AAA", "ADO")(first),
+      enigma("III", "II", "I", [], "AAA", "ADO")(second))
+print("  computed: ", encipher(first), encipher(second), "\n")
+
+print("Homophonic ciphertext as text, counted by ps01/Q2, against its compact array, whole and in chunks:")
+import os, sys, tempfile
+from array import array
+from collections import Counter
+from substitution_ciphers import homophonic_substitution, homophonic_substitution_stream
+from substitution_ciphers import homophonic_text, homophonic_text_stream
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ps01", "Q2"))
+from homophonic import cipher_counts
+with tempfile.TemporaryDirectory() as reference_dir:
+    reference_file = os.path.join(reference_dir, "reference.txt")
+    with open(reference_file, "w") as f:
+        f.write("ADMIRAL GRACE MURRAY HOPPER WROTE THE FIRST COMPILER\n" * 20)
+    plaintext = "\nGrace Hopper\nwrote the first compiler\n\nin 1952\n"
+    ciphertext = homophonic_substitution(reference_file, 100, seed=341)(plaintext, compact=True)
+    chunks = [plaintext[:7], plaintext[7:13], "", plaintext[13:]]
+    streamed = list(homophonic_substitution_stream(reference_file, 100, seed=341, compact=True)(chunks))
+text = homophonic_text(ciphertext)
+whole = homophonic_text(array("i", [symbol for chunk in streamed for symbol in chunk]))
+print("  correct:   True True True")
+print("  computed: ", cipher_counts(text, 1) == dict(Counter(str(s) + " " for s in ciphertext if s >= 0)),
+      text.split(" ") == [str(s) if s >= 0 else "\n" for s in ciphertext],
+      "".join(homophonic_text_stream(streamed)) == whole, "\n")
+
+print("Binary catalog round trip, two rotor orders at rings BCD, written whole and merged from three shards:")
+from catalog import write_catalog, merge_catalogs, SignatureCatalog, signature_key
+from enigma import compute_sigs_for_settings, merge_sig_to_config_dicts
+settings = [("BCD", position) for position in ("AAA", "ADU", "KDO", "QEV", "ZZZ", "MAN", "EVE", "BOB")]
+shard_dicts = [compute_sigs_for_settings(["I", "II", "III"], settings[:5]),
+               compute_sigs_for_settings(["I", "II", "III"], settings[5:]),
+               compute_sigs_for_settings(["V", "IV", "II", "C"], settings)]
+sig_to_config_dict = {}
+for shard_dict in shard_dicts:
+    sig_to_config_dict = merge_sig_to_config_dicts(sig_to_config_dict, {signature: list(configs)
+                                                                        for signature, configs in shard_dict.items()})
+with tempfile.TemporaryDirectory() as catalog_dir:
+    whole_file, merged_file = os.path.join(catalog_dir, "whole.bin"), os.path.join(catalog_dir, "merged.bin")
+    write_catalog(sig_to_config_dict, whole_file)
+    shard_files = [os.path.join(catalog_dir, "shard%d.bin" % i) for i in range(len(shard_dicts))]
+    for shard_dict, shard_file in zip(shard_dicts, shard_files):
+        write_catalog(shard_dict, shard_file)
+    merge_catalogs(shard_files, merged_file)
+    with SignatureCatalog(whole_file) as whole, SignatureCatalog(merged_file) as merged:
+        read_back = {signature: whole.lookup(signature) for signature, count in whole.signatures()}
+        by_ids = [whole.config(config_id) for i in range(len(whole)) for config_id in whole.entry_config_ids(i)]
+        print("  correct:  ", len(sig_to_config_dict), 16, True, True, True)
+        print("  computed: ", len(whole), sum(count for signature, count in whole.signatures()),
+              read_back == sig_to_config_dict,
+              by_ids == [config for signature in sorted(sig_to_config_dict, key=signature_key)
+                         for config in sig_to_config_dict[signature]],
+              {signature: merged.lookup(signature) for signature, count in merged.signatures()} == read_back, "\n")
+
+print("Indicator lookup in a one-order catalog, 300 doubled message keys under I/II/III AAA QEV:")
+import random
+from enigma import gen_starting_positions
+from lookup import IndicatorLookup
+rng = random.Random(341)
+message_keys = ["".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for i in range(3)) for j in range(300)]
+indicators = [enigma("I", "II", "III", [], "AAA", "QEV")(key + key) for key in message_keys]
+with tempfile.TemporaryDirectory() as catalog_dir:
+    catalog_file = os.path.join(catalog_dir, "catalog.bin")
+    write_catalog(compute_sigs_for_settings(["I", "II", "III"], [("AAA", position) for position in gen_starting_positions()]),
+                  catalog_file)
+    lookup = IndicatorLookup(catalog_file)
+    ranked = lookup.query(indicators)
+    errors = []
+    for batch in (indicators[:10], indicators + [indicators[0][:3] + indicators[1][3:]]):
+        try:
+            lookup.query(batch)
+        except ValueError as e:
+            errors.append(str(e))
+    lookup.close()
+true_key = ["I", "II", "III", [], "AAA", "QEV"]
+print("  correct:   rank 3 of 4 at score 2; incomplete; contradicts")
+print("  computed:  rank %d of %d at score %d;" % (
+          [config for score, config in ranked].index(true_key) + 1,
+          sum(1 for score, config in ranked if score == 2),
+          [score for score, config in ranked if config == true_key][0]),
+      "; ".join("incomplete" if "cover all 26" in e else "contradicts" if "contradicts" in e else e for e in errors), "\n")
+
+print("Indicator lookup in a one-order ring catalog, 300 doubled message keys under I/II/III CQF QWE:")
+import contextlib, io
+from enigma import canonical_config, checkpointed_sig_to_config_dictionary
+indicators = [enigma("I", "II", "III", [], "CQF", "QWE")(key + key) for key in message_keys]
+with tempfile.TemporaryDirectory() as catalog_dir:
+    catalog_file = os.path.join(catalog_dir, "catalog.bin")
+    with contextlib.redirect_stderr(io.StringIO()):
+        checkpointed_sig_to_config_dictionary(os.path.join(catalog_dir, "checkpoints"), catalog_file,
+                                              [["I", "II", "III"]], processes=1, rings=True)
+    lookup = IndicatorLookup(catalog_file)
+    ranked = lookup.query(indicators)
+    reloaded = IndicatorLookup(catalog_file)
+    tags_saved = (os.path.exists(catalog_file + ".tags") and reloaded.signature_ids == lookup.signature_ids
+                  and reloaded.next_ids == lookup.next_ids and reloaded.query(indicators) == ranked)
+    lookup.close()
+    reloaded.close()
+true_key = canonical_config(["I", "II", "III", [], "CQF", "QWE"])
+print("  correct:   ['I', 'II', 'III', [], 'AAA', 'OGZ'] ranked 2 of 24 at score 2; tags saved True")
+print("  computed:  %s ranked %d of %d at score %d; tags saved %s" % (
+          true_key, [config for score, config in ranked].index(true_key) + 1,
+          sum(1 for score, config in ranked if score == 2),
+          [score for score, config in ranked if config == true_key][0], tags_saved), "\n")